@@ -0,0 +1,310 @@
+"""
+Benchmarks of the discovery running on the loopback interface only.
+
+Results are printed (or written to --output) as json so that runs can be
+compared to catch regressions.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import queue
+import socket
+import sys
+import threading
+import time
+
+from orwell_common import broadcast
+from orwell_common.broadcast_listener import BatchBroadcastListener
+from orwell_common.broadcast_listener import BroadcastListener
+from orwell_common.broadcast_pinger import BroadcastPinger
+from orwell_common.broadcast_pinger import EventType
+from orwell_common.interfaces import Interface
+from orwell_common.interfaces import StaticInventory
+from orwell_common.scheduler import AdaptiveScheduler
+from orwell_common.simulation import Fabric
+
+
+def _record(results, name, value, unit, **parameters):
+    result = {"name": name, "value": value, "unit": unit}
+    result.update(parameters)
+    results.append(result)
+    print("%s %s: %.6g %s" % (name, parameters, value, unit), file=sys.stderr)
+
+
+def _build_server_game_reply():
+    def record(tag, value):
+        return bytes([tag, len(value)]) + value
+    return (
+        record(0xa0, b"tcp://*:9000") +
+        record(0xa1, b"tcp://*:9001") +
+        record(0xa2, b"tcp://*:9004") +
+        record(0xa3, b"tcp://*:9003") +
+        b"\x00")
+
+
+class _Responder(threading.Thread):
+    """
+    Answer every message received on 127.0.0.1 only (so that the other
+    loopback addresses behave like silent interfaces) until stopped.
+    """
+
+    def __init__(self, reply):
+        threading.Thread.__init__(self, daemon=True)
+        self._reply = reply
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(("127.0.0.1", 0))
+        self._socket.settimeout(0.1)
+        self._answering = True
+        self._stopped = False
+
+    @property
+    def port(self):
+        _, port = self._socket.getsockname()
+        return port
+
+    def set_answering(self, answering):
+        self._answering = answering
+
+    def stop(self):
+        self._stopped = True
+
+    def run(self):
+        while not self._stopped:
+            try:
+                _, address = self._socket.recvfrom(512)
+            except socket.timeout:
+                continue
+            if self._answering:
+                self._socket.sendto(self._reply, address)
+        self._socket.close()
+
+
+def _build_inventory(interface_count):
+    """
+    Interfaces whose broadcast addresses are silent loopback addresses
+    except for the last one, probed last by Broadcast.
+    """
+    entries = [
+        Interface("sim%d" % index, "127.0.%d.1" % index, "255.255.255.0",
+                  "127.0.%d.255" % index)
+        for index in range(1, interface_count)]
+    entries.append(
+        Interface("lo-answer", "127.0.0.1", "255.255.255.255", "127.0.0.1"))
+    return StaticInventory(entries)
+
+
+def bench_listener(results, messages):
+    listener = BroadcastListener(0)
+    thread = threading.Thread(target=listener.run, args=(messages,))
+    thread.start()
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.settimeout(1)
+    window = 64
+    sent = received = 0
+    start = time.perf_counter()
+    while received < messages:
+        while (sent < messages) and (sent - received < window):
+            client.sendto(b"admin", ("127.0.0.1", listener.port))
+            sent += 1
+        try:
+            client.recvfrom(512)
+        except socket.timeout:
+            break
+        received += 1
+    duration = time.perf_counter() - start
+    thread.join(1)
+    client.close()
+    _record(
+        results, "listener_replies_per_second", received / duration, "1/s",
+        messages=messages, received=received)
+
+
+def bench_listener_burst(results, burst):
+    """
+    Send burst messages at once (a fleet powering on) from many sockets and
+    count the replies.
+    """
+    for name, listener_class in (
+            ("simple", BroadcastListener), ("batch", BatchBroadcastListener)):
+        listener = listener_class(0)
+        listener.daemon = True
+        listener.start()
+        clients = [
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            for _ in range(16)]
+        start = time.perf_counter()
+        for index in range(burst):
+            clients[index % len(clients)].sendto(
+                b"admin", ("127.0.0.1", listener.port))
+        received = 0
+        for client in clients:
+            client.settimeout(0.2)
+            while True:
+                try:
+                    client.recvfrom(512)
+                except socket.timeout:
+                    break
+                received += 1
+            client.close()
+        # the last 0.2s only waited for replies that never came
+        duration = time.perf_counter() - start - 0.2 * len(clients)
+        _record(
+            results, "listener_burst_replies", received / burst, "ratio",
+            listener=name, burst=burst)
+        _record(
+            results, "listener_burst_replies_per_second",
+            received / max(duration, 1e-6), "1/s", listener=name, burst=burst)
+
+
+def bench_decoder(results, iterations):
+    data = _build_server_game_reply()
+    decoder = broadcast.ServerGameDecoder()
+    sender = ("127.0.0.1", broadcast.DEFAULT_PORT)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        decoder.decode(sender, data)
+    duration = time.perf_counter() - start
+    _record(
+        results, "server_game_decode_per_second", iterations / duration, "1/s",
+        cached=True)
+    parse = broadcast._decode_server_game.__wrapped__
+    start = time.perf_counter()
+    for _ in range(iterations):
+        parse(sender[0], data, 2)
+    duration = time.perf_counter() - start
+    _record(
+        results, "server_game_decode_per_second", iterations / duration, "1/s",
+        cached=False)
+
+
+def bench_time_to_discovery(results, interface_counts, timeout):
+    responder = _Responder(b"9012")
+    responder.start()
+    try:
+        for interface_count in interface_counts:
+            for mode in ("sequential", "parallel", "async"):
+                inventory = _build_inventory(interface_count)
+                decoder = broadcast.ProxyRobotsDecoder()
+                start = time.perf_counter()
+                if "async" == mode:
+                    broadcaster = broadcast.AsyncBroadcast(
+                        decoder, responder.port, timeout=timeout,
+                        inventory=inventory)
+                    asyncio.run(
+                        broadcaster.async_send_all_broadcast_messages())
+                else:
+                    broadcaster = broadcast.Broadcast(
+                        decoder, responder.port, retries=1, timeout=timeout,
+                        parallel=("parallel" == mode), inventory=inventory)
+                    broadcaster.send_all_broadcast_messages()
+                duration = time.perf_counter() - start
+                broadcaster.close()
+                _record(
+                    results, "time_to_discovery", duration, "s",
+                    mode=mode, interfaces=interface_count, timeout=timeout,
+                    success=decoder.success)
+    finally:
+        responder.stop()
+
+
+def bench_loss_detection(results, sleep_duration, timeout):
+    inventory = _build_inventory(1)
+    for adaptive in (False, True):
+        responder = _Responder(b"9012")
+        responder.start()
+        found = threading.Event()
+        lost = threading.Event()
+        scheduler = None
+        if adaptive:
+            scheduler = AdaptiveScheduler(
+                initial_timeout=timeout, max_timeout=timeout,
+                heartbeat_interval=sleep_duration)
+        pinger = BroadcastPinger(
+            queue.Queue(), sleep_duration=sleep_duration,
+            decoder=broadcast.ProxyRobotsDecoder(), port=responder.port,
+            retries=1, timeout=timeout, scheduler=scheduler,
+            inventory=inventory)
+        pinger.add_callback(lambda event: found.set(), (EventType.FOUND,))
+        pinger.add_callback(lambda event: lost.set(), (EventType.LOST,))
+        pinger.start()
+        found.wait(5)
+        # let the heartbeat settle before cutting the server
+        time.sleep(sleep_duration * 3)
+        responder.set_answering(False)
+        start = time.perf_counter()
+        lost.wait(10 * (sleep_duration + timeout))
+        duration = time.perf_counter() - start
+        pinger.stop()
+        pinger.join()
+        responder.stop()
+        _record(
+            results, "loss_detection_latency", duration, "s",
+            adaptive=adaptive, sleep_duration=sleep_duration, timeout=timeout,
+            detected=lost.is_set())
+
+
+def bench_simulated_fleet(results, robots, loss, timeout):
+    """
+    Every robot of a fleet discovers the server once over a lossy simulated
+    network (see orwell_common.simulation).
+    """
+    fabric = Fabric(seed=0)
+    fabric.add_interface("docker", "172.17.0.0/16")
+    fabric.add_interface(
+        "lan", "10.0.0.0/16", loss=loss, delay=0.002, jitter=0.002,
+        reorder=0.05)
+    server = fabric.add_host("server", "lan")
+    listener = BroadcastListener(broadcast.DEFAULT_PORT, transport=server)
+    for port in range(10000, 10000 + robots):
+        listener.add_socket_port(port)
+    fabric.serve(listener)
+    found = 0
+    start = time.perf_counter()
+    for index in range(robots):
+        robot = fabric.add_host("robot%d" % index, "docker", "lan")
+        broadcaster = broadcast.Broadcast(
+            broadcast.ProxyRobotsDecoder(), timeout=timeout,
+            inventory=robot.inventory(), transport=robot)
+        broadcaster.send_all_broadcast_messages()
+        broadcaster.close()
+        if broadcaster.decoder.success:
+            found += 1
+    duration = time.perf_counter() - start
+    _record(
+        results, "simulated_discoveries_per_second", robots / duration, "1/s",
+        robots=robots, loss=loss, timeout=timeout, found=found,
+        virtual_seconds=fabric.clock.monotonic())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--output", help="file to write the json results to")
+    parser.add_argument(
+        "--quick", action="store_true", help="fewer iterations")
+    arguments = parser.parse_args()
+    # the expected timeouts are not worth a warning here
+    logging.getLogger("orwell").setLevel(logging.ERROR)
+    scale = 1 if arguments.quick else 10
+    results = []
+    bench_listener(results, 1000 * scale)
+    bench_listener_burst(results, 500 * scale)
+    bench_decoder(results, 10000 * scale)
+    bench_time_to_discovery(results, (1, 4, 8), 0.05)
+    bench_loss_detection(results, 0.2, 0.5)
+    bench_simulated_fleet(results, 50 * scale, 0.1, 0.5)
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.time(),
+        "results": results}
+    if arguments.output:
+        with open(arguments.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if '__main__' == __name__:
+    main()
@@ -0,0 +1,121 @@
+"""
+Benchmarks of the startup: time to import the orwell_common modules and
+time from the first import to the first probe answered, each measured in a
+fresh interpreter.
+
+Results are printed (or written to --output) as json so that runs can be
+compared to catch regressions.
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+MODULES = (
+    "orwell_common.broadcast",
+    "orwell_common.broadcast_listener",
+    "orwell_common.broadcast_pinger",
+    "orwell_common.discovery_hub",
+    "orwell_common.connections",
+    "orwell_common.interfaces",
+)
+
+_IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+# the responder is ready before the clock starts so that only the import,
+# the construction and the first probe are measured
+_FIRST_PROBE_SCRIPT = """
+import socket
+import threading
+import time
+
+responder = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+responder.bind(("127.0.0.1", 0))
+_, port = responder.getsockname()
+
+
+def answer():
+    _, address = responder.recvfrom(512)
+    responder.sendto(b"9012", address)
+
+
+threading.Thread(target=answer, daemon=True).start()
+start = time.perf_counter()
+from orwell_common import broadcast
+broadcaster = broadcast.Broadcast(broadcast.ProxyRobotsDecoder(), port)
+# what the first discovery does before its first message
+broadcaster.reset()
+broadcaster._group = ("127.0.0.1", port)
+if not broadcaster.send_one_broadcast_message():
+    raise SystemExit("no reply")
+print(time.perf_counter() - start)
+"""
+
+
+def _record(results, name, value, unit, **parameters):
+    result = {"name": name, "value": value, "unit": unit}
+    result.update(parameters)
+    results.append(result)
+    print("%s %s: %.6g %s" % (name, parameters, value, unit), file=sys.stderr)
+
+
+def _run(script, runs):
+    """
+    Return the median of the durations printed by script over runs fresh
+    interpreters.
+    """
+    durations = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", script],
+            check=True, stdout=subprocess.PIPE, universal_newlines=True)
+        durations.append(float(output.stdout.split()[-1]))
+    return statistics.median(durations)
+
+
+def bench_imports(results, runs):
+    for module in MODULES:
+        _record(
+            results, "import_seconds",
+            _run(_IMPORT_SCRIPT.format(module=module), runs), "s",
+            module=module, runs=runs)
+
+
+def bench_first_probe(results, runs):
+    _record(
+        results, "time_to_first_probe", _run(_FIRST_PROBE_SCRIPT, runs), "s",
+        runs=runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--output", help="file to write the json results to")
+    parser.add_argument(
+        "--quick", action="store_true", help="fewer iterations")
+    arguments = parser.parse_args()
+    runs = 3 if arguments.quick else 15
+    results = []
+    bench_imports(results, runs)
+    bench_first_probe(results, runs)
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.time(),
+        "results": results}
+    if arguments.output:
+        with open(arguments.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if '__main__' == __name__:
+    main()
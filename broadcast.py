@@ -6,6 +6,7 @@ from orwell_common.broadcast import ServerGameDecoder
 from orwell_common.broadcast import ProxyRobotsDecoder
 from orwell_common.broadcast import Broadcast
 from orwell_common.broadcast import AsyncBroadcast
+from orwell_common.broadcast import DEFAULT_MULTICAST_GROUP
 
 
 def main():
@@ -26,6 +27,19 @@ def main():
         broadcast = Broadcast(decoder())
         broadcast.send_all_broadcast_messages()
         print(broadcast.decoder)
+    elif "parallel" == function:
+        broadcast = Broadcast(decoder(), parallel=True)
+        broadcast.send_all_broadcast_messages()
+        print(broadcast.decoder)
+    elif "multicast" == function:
+        broadcast = Broadcast(
+            decoder(), multicast_group=DEFAULT_MULTICAST_GROUP)
+        broadcast.send_all_broadcast_messages()
+        print(broadcast.decoder)
+    elif "all" == function:
+        broadcast = Broadcast(decoder())
+        for responder in broadcast.discover_all():
+            print(responder.address, responder.latency, responder.decoder)
     elif "async" == function:
         broadcast = AsyncBroadcast(decoder())
         asyncio.run(broadcast.async_send_all_broadcast_messages())
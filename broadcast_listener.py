@@ -9,7 +9,8 @@ def main():
     argc = len(sys.argv)
     if argc > 1:
         max_loops = int(sys.argv[1])
-        # put only max_loops - 1 ports so that last response will be goodbye
+        # put only max_loops - 1 ports so that with max_loops different robots
+        # the last response will be goodbye (a robot keeps its port)
         for i in range(max_loops - 1):
             listener.add_socket_port(i)
     else:
@@ -0,0 +1,210 @@
+import asyncio
+import itertools
+import logging
+
+from orwell_common import metrics
+from orwell_common.broadcast import Broadcast
+from orwell_common.broadcast import DEFAULT_PORT
+
+LOGGER = logging.getLogger(__name__.replace("orwell_common", "orwell.common"))
+
+
+class _DatagramQueueProtocol(asyncio.DatagramProtocol):
+    """
+    Queue the datagrams received so that coroutines can await them as soon as
+    they arrive.
+    """
+
+    def __init__(self):
+        self._datagrams = asyncio.Queue()
+
+    def datagram_received(self, data, addr):
+        self._datagrams.put_nowait((data, addr))
+
+    def error_received(self, exc):
+        LOGGER.debug("error received: %s", exc)
+
+    async def get(self):
+        """
+        Wait for the next (data, sender).
+        """
+        return await self._datagrams.get()
+
+    def drain(self):
+        """
+        Discard the datagrams already received and return them.
+        """
+        datagrams = []
+        while not self._datagrams.empty():
+            datagrams.append(self._datagrams.get_nowait())
+        return datagrams
+
+
+class AsyncBroadcast(Broadcast):
+    def __init__(
+            self,
+            decoder,
+            port=DEFAULT_PORT,
+            timeout=2,
+            persistent=False,
+            inventory=None,
+            policy=None,
+            metrics_registry=None,
+            multicast_group=None):
+        """
+        timeout: maximum time in seconds to wait for a reply to one message.
+        persistent: if True the same transport is used for every message until
+        close is called.
+        inventory: InterfaceInventory giving the broadcast addresses.
+        policy: InterfacePolicy choosing and ordering the interfaces to probe.
+        metrics_registry: Metrics where the discovery is recorded.
+        multicast_group: multicast group probed once before the broadcast
+        addresses (see Broadcast).
+        """
+        super().__init__(
+            decoder, port, 0, timeout, persistent=persistent,
+            inventory=inventory, policy=policy,
+            metrics_registry=metrics_registry,
+            multicast_group=multicast_group)
+        self._ips_iterator = None
+        self._endpoint = None
+        self._protocol = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._endpoint is not None:
+            self._endpoint.close()
+            self._endpoint = None
+            self._protocol = None
+            # the transport closed the socket
+            self._udp_socket = None
+        else:
+            super().close()
+
+    def _build_socket(self):
+        super()._build_socket()
+        self._udp_socket.setblocking(False)
+
+    def _on_interfaces_changed(self, interfaces, added):
+        super()._on_interfaces_changed(interfaces, added)
+        self._ips_iterator = self._cycle_network_ips()
+
+    def _cycle_network_ips(self):
+        """
+        Cycle over the broadcast addresses in the order they would be tried by
+        Broadcast.
+        """
+        return itertools.cycle(self._get_network_ips()[::-1])
+
+    def _drain_stale_replies(self):
+        for data, sender in self._protocol.drain():
+            self._stale_replies += 1
+            LOGGER.debug('discarded stale reply "%r" from %s', data, sender)
+
+    async def _open_endpoint(self):
+        if self._endpoint is None:
+            loop = asyncio.get_running_loop()
+            self._endpoint, self._protocol = (
+                await loop.create_datagram_endpoint(
+                    _DatagramQueueProtocol, sock=self._socket))
+
+    async def async_send_all_broadcast_messages(self):
+        self._received = False
+        if self._multicast_group is not None:
+            self._group = self._get_group(self._multicast_group)
+            await self.async_send_one_broadcast_message()
+            if self._received:
+                self._try_decode_data()
+            if self._decoder.success:
+                self._found_group = self._group
+                return
+        # give the inventory a chance to report new interfaces
+        self._inventory.interfaces()
+        if self._ips_iterator is None:
+            self._ips_iterator = self._cycle_network_ips()
+        self._group = self._get_group(next(self._ips_iterator))
+        while True:
+            await self.async_send_one_broadcast_message()
+            if self._received:
+                self._try_decode_data()
+                self._record_result()
+                break
+            self._record_result()
+            self._group = self._get_group(next(self._ips_iterator))
+
+    async def async_discover_all(self, window=None):
+        """
+        Same as discover_all without blocking the event loop.
+        """
+        if window is None:
+            window = self._timeout
+        groups = self._get_all_groups()
+        responders = {}
+        await self._open_endpoint()
+        try:
+            self._start_probe()
+            start = self._transport.monotonic()
+            for group in groups:
+                self._endpoint.sendto(self._message, group)
+                self._count(metrics.PROBES_SENT, group[0])
+            deadline = start + window
+            while True:
+                remaining = deadline - self._transport.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    data, sender = await asyncio.wait_for(
+                        self._protocol.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                latency = self._transport.monotonic() - start
+                self._count_reply(sender[0], latency)
+                responder = self._make_responder(sender, data, latency)
+                if responder and (sender not in responders):
+                    responders[sender] = responder
+        finally:
+            if not self._persistent:
+                self.close()
+        return sorted(responders.values(), key=lambda r: r.latency)
+
+    async def async_send_one_broadcast_message(self):
+        self._decoder.reset()
+        self._received = False
+        await self._open_endpoint()
+        try:
+            self._start_probe()
+            LOGGER.debug("before sendto")
+            start = self._transport.monotonic()
+            self._endpoint.sendto(self._message, self._group)
+            self._count(metrics.PROBES_SENT, self._group[0])
+            LOGGER.debug("after sendto")
+            deadline = start + self._timeout
+            while not self._received:
+                remaining = deadline - self._transport.monotonic()
+                try:
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError()
+                    data, sender = await asyncio.wait_for(
+                        self._protocol.get(), remaining)
+                except asyncio.TimeoutError:
+                    LOGGER.info("Failed to contact %s", self._group)
+                    self._count(metrics.TIMEOUTS, self._group[0])
+                    break
+                if not self._is_fresh_reply(data, sender):
+                    continue
+                self._data, self._sender = data, sender
+                self._rtt = self._transport.monotonic() - start
+                self._received = True
+                self._count_reply(self._group[0], self._rtt)
+                LOGGER.info(
+                    'received "%r" from %s', self._data, self._sender)
+        finally:
+            if not self._persistent:
+                LOGGER.info('closing socket')
+                self.close()
+        return self._received
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+
+from orwell_common.broadcast_listener import PortResponder
+from orwell_common.broadcast_listener import _join_multicast_group
+
+LOGGER = logging.getLogger(__name__.replace("orwell_common", "orwell.common"))
+
+
+class _ResponderProtocol(asyncio.DatagramProtocol):
+    """
+    Answer each datagram received with the data returned by responder.
+    """
+
+    def __init__(self, responder):
+        self._responder = responder
+        self._transport = None
+        self.closed = asyncio.get_running_loop().create_future()
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def connection_lost(self, exc):
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    def datagram_received(self, data, addr):
+        if not data:
+            # like BroadcastListener, an empty datagram is not a request
+            return
+        LOGGER.debug("Received UDP broadcast %s from %s", data, addr)
+        response = self._responder(data, addr)
+        if response is not None:
+            self._transport.sendto(response, addr)
+
+    def error_received(self, exc):
+        LOGGER.debug("error received: %s", exc)
+
+
+class AsyncBroadcastListener(PortResponder):
+    """
+    Same as BroadcastListener but runs inside an existing event loop.
+    """
+
+    def __init__(
+            self,
+            port=9081,
+            admin_port=9082,
+            port_pool=None,
+            rate_limiter=None,
+            reply_cache=None,
+            multicast_group=None,
+            inventory=None,
+            multicast_policy=None):
+        """
+        port: port to listen to (0 to let the system choose).
+        multicast_group, inventory, multicast_policy: see BroadcastListener.
+        """
+        PortResponder.__init__(
+            self, admin_port, port_pool, rate_limiter, reply_cache)
+        self._port = port
+        self._multicast_group = multicast_group
+        self._inventory = inventory
+        self._multicast_policy = multicast_policy
+        self._transport = None
+        self._protocol = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+        await self.wait_closed()
+
+    async def start(self):
+        """
+        Start answering messages.
+        """
+        loop = asyncio.get_running_loop()
+        self._transport, self._protocol = await loop.create_datagram_endpoint(
+            lambda: _ResponderProtocol(self.respond),
+            local_addr=('0.0.0.0', self._port))
+        _, self._port = self._transport.get_extra_info("sockname")
+        if self._multicast_group is not None:
+            _join_multicast_group(
+                self._transport.get_extra_info("socket"),
+                self._multicast_group, self._inventory,
+                self._multicast_policy)
+
+    async def serve_forever(self):
+        """
+        Answer messages until close is called.
+        """
+        if self._transport is None:
+            await self.start()
+        await self.wait_closed()
+
+    def close(self):
+        """
+        Stop answering messages.
+        """
+        if self._transport is not None:
+            self._transport.close()
+
+    async def wait_closed(self):
+        if self._protocol is not None:
+            await self._protocol.closed
+
+    @property
+    def port(self):
+        return self._port
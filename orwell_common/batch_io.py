@@ -0,0 +1,233 @@
+"""
+Receive and send many datagrams per system call with recvmmsg and sendmmsg
+(Linux) through ctypes, or with a tight non-blocking loop of recvfrom and
+sendto elsewhere.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import socket
+import struct
+import sys
+
+LOGGER = logging.getLogger(__name__.replace("orwell_common", "orwell.common"))
+
+# room for a sockaddr_in6 (sockaddr_in only needs 16 bytes)
+_ADDRESS_SIZE = 28
+_FAMILY = struct.Struct("=H")
+_PORT_AND_IP = struct.Struct("!H4s")
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_hdr", _MsgHdr),
+        ("msg_len", ctypes.c_uint)]
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except OSError as ex:
+        LOGGER.debug("libc not available: %s", ex)
+        return None
+    if not (hasattr(libc, "recvmmsg") and hasattr(libc, "sendmmsg")):
+        return None
+    libc.recvmmsg.argtypes = (
+        ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int,
+        ctypes.c_void_p)
+    libc.recvmmsg.restype = ctypes.c_int
+    libc.sendmmsg.argtypes = (
+        ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int)
+    libc.sendmmsg.restype = ctypes.c_int
+    return libc
+
+
+# loaded by has_mmsg: finding libc can take a while
+_LIBC = None
+_LIBC_LOADED = False
+
+
+def has_mmsg():
+    """
+    Return True if recvmmsg and sendmmsg are available.
+    """
+    global _LIBC, _LIBC_LOADED
+    if not _LIBC_LOADED:
+        _LIBC = _load_libc()
+        _LIBC_LOADED = True
+    return _LIBC is not None
+
+
+def _encode_address(address):
+    ip, port = address
+    return (
+        _FAMILY.pack(socket.AF_INET) +
+        _PORT_AND_IP.pack(port, socket.inet_aton(ip)) +
+        bytes(8))
+
+
+def _decode_address(raw):
+    family, = _FAMILY.unpack_from(raw)
+    if family != socket.AF_INET:
+        return None
+    port, ip = _PORT_AND_IP.unpack_from(raw, _FAMILY.size)
+    return socket.inet_ntoa(ip), port
+
+
+class DatagramBatcher(object):
+    """
+    Move up to batch_size datagrams of at most size bytes at a time on a
+    non-blocking IPv4 UDP socket. The buffers are allocated once.
+    """
+
+    def __init__(self, sock, batch_size=64, size=4096, use_mmsg=True):
+        """
+        use_mmsg: use recvmmsg/sendmmsg when available (the fallback loop is
+        used otherwise).
+        """
+        self._socket = sock
+        self._batch_size = batch_size
+        self._size = size
+        self._use_mmsg = use_mmsg and has_mmsg()
+        if self._use_mmsg:
+            self._build_buffers()
+
+    @property
+    def uses_mmsg(self):
+        return self._use_mmsg
+
+    def _build_buffers(self):
+        count = self._batch_size
+        self._data = (ctypes.c_char * (count * self._size))()
+        self._names = (ctypes.c_char * (count * _ADDRESS_SIZE))()
+        self._iovecs = (_IOVec * count)()
+        self._headers = (_MMsgHdr * count)()
+        data_address = ctypes.addressof(self._data)
+        names_address = ctypes.addressof(self._names)
+        for index in range(count):
+            self._iovecs[index].iov_base = data_address + index * self._size
+            self._iovecs[index].iov_len = self._size
+            header = self._headers[index].msg_hdr
+            header.msg_name = names_address + index * _ADDRESS_SIZE
+            header.msg_iov = ctypes.pointer(self._iovecs[index])
+            header.msg_iovlen = 1
+
+    def receive(self):
+        """
+        Return the list of (data, address) waiting on the socket, at most
+        batch_size of them (empty if there is none).
+        """
+        if self._use_mmsg:
+            return self._receive_mmsg()
+        return self._receive_loop()
+
+    def send(self, datagrams):
+        """
+        Send the (data, address) of datagrams and return how many were sent
+        before the socket buffer got full.
+        """
+        if self._use_mmsg:
+            return self._send_mmsg(datagrams)
+        return self._send_loop(datagrams)
+
+    def _receive_loop(self):
+        datagrams = []
+        while len(datagrams) < self._batch_size:
+            try:
+                datagrams.append(self._socket.recvfrom(self._size))
+            except (BlockingIOError, socket.timeout):
+                break
+        return datagrams
+
+    def _send_loop(self, datagrams):
+        sent = 0
+        for data, address in datagrams:
+            try:
+                self._socket.sendto(data, address)
+            except (BlockingIOError, socket.timeout):
+                break
+            sent += 1
+        return sent
+
+    def _receive_mmsg(self):
+        for index in range(self._batch_size):
+            self._headers[index].msg_hdr.msg_namelen = _ADDRESS_SIZE
+        count = _LIBC.recvmmsg(
+            self._socket.fileno(), self._headers, self._batch_size,
+            socket.MSG_DONTWAIT, None)
+        if count < 0:
+            self._check_errno()
+            return []
+        datagrams = []
+        for index in range(count):
+            start = index * _ADDRESS_SIZE
+            address = _decode_address(
+                self._names[start:start + _ADDRESS_SIZE])
+            if address is None:
+                continue
+            start = index * self._size
+            length = self._headers[index].msg_len
+            datagrams.append((self._data[start:start + length], address))
+        return datagrams
+
+    def _send_mmsg(self, datagrams):
+        sent = 0
+        while sent < len(datagrams):
+            batch = datagrams[sent:sent + self._batch_size]
+            count = len(batch)
+            headers = (_MMsgHdr * count)()
+            iovecs = (_IOVec * count)()
+            # keep the buffers alive until sendmmsg returns
+            buffers = []
+            for index, (data, address) in enumerate(batch):
+                payload = ctypes.create_string_buffer(bytes(data), len(data))
+                name = ctypes.create_string_buffer(
+                    _encode_address(address), _ADDRESS_SIZE)
+                buffers.append((payload, name))
+                iovecs[index].iov_base = ctypes.addressof(payload)
+                iovecs[index].iov_len = len(data)
+                header = headers[index].msg_hdr
+                header.msg_name = ctypes.addressof(name)
+                header.msg_namelen = 16
+                header.msg_iov = ctypes.pointer(iovecs[index])
+                header.msg_iovlen = 1
+            result = _LIBC.sendmmsg(
+                self._socket.fileno(), headers, count, socket.MSG_DONTWAIT)
+            if result < 0:
+                self._check_errno()
+                break
+            sent += result
+            if result < count:
+                break
+        return sent
+
+    @staticmethod
+    def _check_errno():
+        """
+        Raise the error of the last call unless it only means that it would
+        have blocked.
+        """
+        number = ctypes.get_errno()
+        if number in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+            return
+        raise OSError(number, errno.errorcode.get(number, str(number)))
@@ -1,19 +1,42 @@
 import logging
-import asyncio
-import itertools
-import netifaces
+import collections
+import copy
+import functools
 import socket
 import struct
-import enum
+import sys
+
+from orwell_common import codec
+from orwell_common import interfaces
+from orwell_common import metrics
+from orwell_common.codec import DecodeError
+from orwell_common.codec import Kind
+import orwell_common.transport
 
 LOGGER = logging.getLogger(__name__.replace("orwell_common", "orwell.common"))
 
 DEFAULT_PORT = 9080
+# organization-local scope (RFC 2365)
+DEFAULT_MULTICAST_GROUP = "239.255.90.80"
+
 
+@functools.lru_cache(maxsize=64)
+def _decode_server_game(sender_ip, data, version):
+    """
+    Return the ServerGameAdvert of a ServerGame at sender_ip (see codec for
+    the layouts), the '*' of the addresses replaced by sender_ip.
 
-class Kind(enum.Enum):
-    SERVER_GAME = "ServerGame"
-    PROXY_ROBOTS = "ProxyRobots"
+    The results are cached as a server keeps sending the same reply.
+    """
+    advert = codec.decode(Kind.SERVER_GAME, version, data)
+    addresses = [
+        None if address is None else sys.intern(address.replace('*', sender_ip))
+        for address in advert[:4]]
+    return advert._replace(
+        push_address=addresses[0],
+        subscribe_address=addresses[1],
+        reply_address=addresses[2],
+        agent_address=addresses[3])
 
 
 class ServerGameDecoder(object):
@@ -22,7 +45,12 @@ class ServerGameDecoder(object):
         self._subscribe_address = None
         self._reply_address = None
         self._agent_address = None
+        self._load = None
+        self._capacity = None
+        self._game_id = None
         self._decoding_successful = False
+        # fail early on a version no codec can decode
+        codec.get_codec(Kind.SERVER_GAME, version)
         self._version = version
 
     @property
@@ -35,50 +63,15 @@ class ServerGameDecoder(object):
 
     def decode(self, sender, data):
         sender_ip, _ = sender
-        # data (split on multiple lines for clarity):
-        # 0xA0
-        # size on 8 bytes
-        # Address of puller
-        # 0xA1
-        # size on 8 bytes
-        # Address of publisher
-        # 0xA2
-        # size on 8 bytes
-        # Address of replier
-        # 0xA3
-        # size on 8 bytes
-        # Address of agent
-        # 0x00
-        to_str = lambda x: x.decode("ascii")
-        assert (data[0] == 0xa0)
-        puller_size = int(data[1])
-        # print("puller_size =", puller_size)
-        end_puller = 2 + puller_size
-        puller_address = to_str(data[2:end_puller])
-        # print("puller_address =", puller_address)
-        assert (data[end_puller] == 0xa1)
-        publisher_size = int(data[end_puller + 1])
-        # print("publisher_size =", str(publisher_size))
-        end_publisher = end_puller + 2 + publisher_size
-        publisher_address = to_str(data[end_puller + 2:end_publisher])
-        # print("publisher_address =", publisher_address)
-        assert (data[end_publisher] == 0xa2)
-        replier_size = int(data[end_publisher + 1])
-        # print("replier_size =", str(replier_size))
-        end_replier = end_publisher + 2 + replier_size
-        replier_address = to_str(data[end_publisher + 2:end_replier])
-        if 0xa3 == data[end_replier]:
-            agent_size = int(data[end_replier + 1])
-            # print("agent_size =", str(agent_size))
-            end_agent = end_replier + 2 + agent_size
-            agent_address = to_str(data[end_replier + 2:end_agent])
-            # print("agent_address =", agent_address)
-            self._agent_address = agent_address.replace('*', sender_ip)
-        else:
-            assert(self.version < 2)
-        self._push_address = puller_address.replace('*', sender_ip)
-        self._subscribe_address = publisher_address.replace('*', sender_ip)
-        self._reply_address = replier_address.replace('*', sender_ip)
+        advert = _decode_server_game(sender_ip, bytes(data), self._version)
+        self._push_address = advert.push_address
+        self._subscribe_address = advert.subscribe_address
+        self._reply_address = advert.reply_address
+        if advert.agent_address is not None:
+            self._agent_address = advert.agent_address
+        self._load = advert.load
+        self._capacity = advert.capacity
+        self._game_id = advert.game_id
         self._decoding_successful = True
 
     def reset(self):
@@ -100,6 +93,26 @@ class ServerGameDecoder(object):
     def agent_address(self):
         return self._agent_address
 
+    @property
+    def load(self):
+        """
+        Number of players of the server (version 3 and above, None if not
+        advertised).
+        """
+        return self._load
+
+    @property
+    def capacity(self):
+        """
+        Maximum number of players of the server (version 3 and above, None
+        if not advertised).
+        """
+        return self._capacity
+
+    @property
+    def game_id(self):
+        return self._game_id
+
     @property
     def success(self):
         return self._decoding_successful
@@ -116,6 +129,7 @@ class ProxyRobotsDecoder(object):
     def __init__(self, *, version="robot"):
         self._port = None
         self._decoding_successful = False
+        codec.get_codec(Kind.PROXY_ROBOTS, version)
         self._version = version
 
     @property
@@ -128,11 +142,12 @@ class ProxyRobotsDecoder(object):
 
     def decode(self, sender, data):
         try:
-            self._port = int(data)
+            advert = codec.decode(Kind.PROXY_ROBOTS, self._version, data)
+            self._port = advert.port
             self._decoding_successful = True
-        except Exception as ex:
-            LOGGER.warning("Could not decode broadcast message: " + repr(data))
-            LOGGER.warning(str(ex))
+        except DecodeError as ex:
+            LOGGER.warning("Could not decode broadcast message: %r", data)
+            LOGGER.warning("%s", ex)
 
     def reset(self):
         self._decoding_successful = False
@@ -149,53 +164,229 @@ class ProxyRobotsDecoder(object):
         return self._port
 
 
+Responder = collections.namedtuple(
+    "Responder", ("address", "decoder", "latency"))
+Responder.__doc__ = """
+A server that replied to a discovery: its (ip, port), a decoder holding
+what it advertised and the round-trip time in seconds of the probe.
+"""
+
+
+def least_loaded(responders):
+    """
+    Return the ServerGame responder (see Broadcast.discover_all) with the
+    lowest load relative to its capacity, the fastest one first among
+    equals, or None if there is none. Servers that do not advertise their
+    load (before version 3) come after the others.
+    """
+    def key(responder):
+        decoder = responder.decoder
+        if (decoder.load is None) or (not decoder.capacity):
+            return (1, 0, responder.latency)
+        return (0, decoder.load / decoder.capacity, responder.latency)
+    candidates = [
+        responder for responder in responders
+        if Kind.SERVER_GAME == responder.decoder.kind]
+    if not candidates:
+        return None
+    return min(candidates, key=key)
+
+
 def get_network_ips():
-    results = []
-    for interface in netifaces.interfaces():
-        addresses = netifaces.ifaddresses(interface)
-        if netifaces.AF_INET not in addresses:
-            continue
-        ipv4_addresses = addresses[netifaces.AF_INET]
-        if not ipv4_addresses:
-            continue
-        for ipv4_address in ipv4_addresses:
-            if "broadcast" not in ipv4_address:
-                continue
-            results.append(ipv4_address["broadcast"])
-    return results[::-1]
+    return [entry.broadcast for entry in interfaces.scan_interfaces()][::-1]
 
 
 class Broadcast(object):
-    def __init__(self, decoder, port=DEFAULT_PORT, retries=2, timeout=3):
+    def __init__(
+            self,
+            decoder,
+            port=DEFAULT_PORT,
+            retries=2,
+            timeout=3,
+            parallel=False,
+            persistent=False,
+            cache=None,
+            inventory=None,
+            policy=None,
+            metrics_registry=None,
+            transport=None,
+            multicast_group=None):
+        """
+        parallel: if True send_all_broadcast_messages probes every interface
+        at once instead of one interface after the other.
+        persistent: if True the same socket is used for every message until
+        close is called, otherwise the socket is rebuilt after each message.
+        cache: DiscoveryCache where successful discoveries are recorded and
+        that is checked first by send_all_broadcast_messages.
+        inventory: InterfaceInventory giving the broadcast addresses (the one
+        shared by the process by default).
+        Neither the socket nor the default inventory are created before
+        they are needed by the first message.
+        policy: InterfacePolicy choosing and ordering the interfaces to probe,
+        it is told which interfaces answered.
+        metrics_registry: Metrics where probes, replies, timeouts, decoding
+        failures, round-trip and discovery times are recorded (metrics.METRICS
+        by default).
+        transport: where sockets and time come from (transport.SYSTEM by
+        default, see simulation.Fabric).
+        multicast_group: if not None address of the multicast group (see
+        DEFAULT_MULTICAST_GROUP) probed with a single message before falling
+        back to the broadcast addresses of the interfaces.
+        """
+        if transport is None:
+            transport = orwell_common.transport.SYSTEM
+        self._transport = transport
+        self._multicast_group = multicast_group
         self._port = port
+        self._parallel = parallel
+        self._persistent = persistent
+        self._stale_replies = 0
+        self._interrupted = False
+        self._cache = cache
         self._size = 512
         self._retries = retries
         self._timeout = timeout
-        self._build_socket()
-        self._ips_pool = get_network_ips()
-        LOGGER.debug("ips: %s", self._ips_pool)
+        self._udp_socket = None
+        self._interface_inventory = inventory
+        if inventory is not None:
+            inventory.subscribe(self._on_interfaces_changed)
+        self._policy = policy
+        self._rtt = None
+        if metrics_registry is None:
+            metrics_registry = metrics.METRICS
+        self._metrics = metrics_registry
+        self._interface_labels = {}
+        self._ips_pool = None
         self._group = None
         self._found_group = None
         self._received = False
         self._data = None
         self._sender = None
         self._decoder = decoder
-        self._message = str(self._decoder.version).encode("ascii")
+        self._message = codec.encode_request(self._decoder.version)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._udp_socket is not None:
+            self._udp_socket.close()
+            self._udp_socket = None
+
+    @property
+    def _socket(self):
+        if self._udp_socket is None:
+            self._build_socket()
+        return self._udp_socket
+
+    @property
+    def _inventory(self):
+        if self._interface_inventory is None:
+            self._interface_inventory = interfaces.get_default_inventory()
+            self._interface_inventory.subscribe(self._on_interfaces_changed)
+        return self._interface_inventory
+
+    def interrupt(self):
+        """
+        Make the probe waiting for a reply in another thread give up at once,
+        as well as any later probe. The blocked socket is woken up with an
+        empty datagram sent to itself.
+        """
+        self._interrupted = True
+        if self._udp_socket is None:
+            return
+        try:
+            _, port = self._udp_socket.getsockname()
+            if port:
+                with self._transport.socket() as waker:
+                    waker.sendto(b"", ("127.0.0.1", port))
+        except OSError as ex:
+            LOGGER.debug("could not wake up socket: %s", ex)
 
     def set_decoder(self, decoder):
         self._decoder = decoder
 
+    def _recycle_socket(self):
+        """
+        Drop the socket used for the last message unless it is persistent.
+        """
+        if not self._persistent:
+            self.close()
+
+    def _start_probe(self):
+        """
+        As the servers do not echo anything back, a persistent socket first
+        discards the replies still queued for the previous probes so that
+        they cannot be mistaken for fresh ones (see also _is_fresh_reply).
+        """
+        if self._persistent:
+            self._drain_stale_replies()
+
+    def _drain_stale_replies(self):
+        self._socket.setblocking(False)
+        try:
+            while True:
+                try:
+                    data, sender = self._socket.recvfrom(self._size)
+                except BlockingIOError:
+                    break
+                self._stale_replies += 1
+                LOGGER.debug(
+                    'discarded stale reply "%r" from %s', data, sender)
+        finally:
+            self._socket.settimeout(self._timeout)
+
+    def _is_fresh_reply(self, data, sender):
+        """
+        Return True if sender can have answered the probe sent to the current
+        group: it is the group itself, or it belongs to the network of the
+        interface of the group, or the group is the multicast one. The late
+        reply to an earlier probe (that a persistent socket can receive while
+        waiting for the next one) is counted as stale otherwise.
+        """
+        if not self._persistent:
+            return True
+        sender_ip, _ = sender
+        group_ip, _ = self._group
+        if (sender_ip == group_ip) or (group_ip == self._multicast_group):
+            return True
+        interface = interfaces.find_interface(
+            self._inventory.interfaces(), group_ip)
+        if (interface is not None) and (
+                interfaces.find_interface((interface,), sender_ip) is not None):
+            return True
+        self._stale_replies += 1
+        LOGGER.debug(
+            'discarded stale reply "%r" from %s while waiting for %s',
+            data, sender, self._group)
+        return False
+
+    @property
+    def stale_replies(self):
+        """
+        Number of replies that arrived too late for the probe they answer.
+        """
+        return self._stale_replies
+
     def _build_socket(self):
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        self._socket.settimeout(self._timeout)
+        self._udp_socket = self._transport.socket(
+            socket.AF_INET, socket.SOCK_DGRAM)
+        self._udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self._udp_socket.settimeout(self._timeout)
         ttl = struct.pack('b', 1)
-        self._socket.setsockopt(
+        self._udp_socket.setsockopt(
             socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
 
     def _get_next_group(self, force_group=None):
         if force_group is not None:
             return force_group
+        # give the inventory a chance to report new interfaces
+        self._inventory.interfaces()
+        if self._ips_pool is None:
+            self.reset()
         if self._ips_pool:
             broadcast = self._ips_pool.pop()
             return self._get_group(broadcast)
@@ -204,23 +395,41 @@ class Broadcast(object):
 
     def _get_group(self, ip):
         group = ip, self._port
-        LOGGER.debug('group = ' + str(group))
+        LOGGER.debug('group = %s', group)
         return group
 
     def send_all_broadcast_messages(self):
+        start = self._transport.monotonic()
+        if self._probe_cached_group():
+            pass
+        elif self._parallel:
+            # the multicast group is among the groups probed at once
+            self.send_parallel_broadcast_messages()
+        elif not self._probe_multicast_group():
+            self._send_all_broadcast_messages_in_turn()
+        if self._decoder.success:
+            self._metrics.observe(
+                metrics.DISCOVERY_SECONDS,
+                self._transport.monotonic() - start,
+                kind=self._decoder.kind.value)
+
+    def _send_all_broadcast_messages_in_turn(self):
         self.reset()
         self._received = False
         self._group = self._get_next_group(self._found_group)
-        while self._group:
+        while self._group and not self._interrupted:
             tries = 0
             while (tries < self._retries) and (not self._received):
                 tries += 1
-                LOGGER.debug("Try " + str(tries) + " group: " + str(self._group))
+                LOGGER.debug("Try %s group: %s", tries, self._group)
                 self.send_one_broadcast_message()
             if self._received:
                 self._found_group = self._group
-                self.decode_data()
+                self._try_decode_data()
+                self._record_result()
+                self._remember_group()
                 break
+            self._record_result()
             self._group = self._get_next_group()
 
     def send_some_broadcast_messages(self):
@@ -231,45 +440,328 @@ class Broadcast(object):
         tries = 0
         while (tries < self._retries) and (not self._received):
             tries += 1
-            LOGGER.debug("Try " + str(tries) + " group: " + str(self._group))
+            LOGGER.debug("Try %s group: %s", tries, self._group)
             self.send_one_broadcast_message()
         if self._received:
             self._found_group = self._group
-            self.decode_data()
+            self._try_decode_data()
+            self._record_result()
+            self._remember_group()
             return
+        self._record_result()
         self._group = self._get_next_group()
 
+    def send_parallel_broadcast_messages(self):
+        """
+        Send the message to every broadcast address at once over the same
+        socket and keep the first reply that can be decoded. Each try waits at
+        most timeout seconds whatever the number of interfaces.
+        """
+        groups = self._get_all_groups()
+        if self._found_group and (self._found_group not in groups):
+            groups.insert(0, self._found_group)
+        self._decoder.reset()
+        self._received = False
+        tries = 0
+        try:
+            while ((tries < self._retries) and
+                    (not self._decoder.success) and
+                    (not self._interrupted)):
+                tries += 1
+                LOGGER.debug("Try %s groups: %s", tries, groups)
+                self._start_probe()
+                start = self._transport.monotonic()
+                self._send_to_groups(groups)
+                deadline = start + self._timeout
+                while not self._decoder.success:
+                    received = self._receive_before(deadline)
+                    if received is None:
+                        LOGGER.warning('timed out, no more responses')
+                        self._count(metrics.TIMEOUTS)
+                        break
+                    self._rtt = self._transport.monotonic() - start
+                    self._data, self._sender = received
+                    self._count_reply(self._sender[0], self._rtt)
+                    LOGGER.info(
+                        'received "%r" from %s', self._data, self._sender)
+                    self._try_decode_data()
+        finally:
+            self._recycle_socket()
+        self._received = self._decoder.success
+        if self._received:
+            sender_ip, _ = self._sender
+            self._group = self._get_group(sender_ip)
+            self._found_group = self._group
+            self._record_result()
+            self._remember_group()
+        else:
+            self._group = None
+
+    def _probe_cached_group(self):
+        """
+        Try the group found by an earlier discovery (if cached) with the short
+        timeout of the cache. Return True if it answered, otherwise forget it.
+        """
+        if self._cache is None:
+            return False
+        entry = self._cache.get(self._decoder.kind, self._decoder.version)
+        if entry is None:
+            return False
+        LOGGER.debug("probe cached group %s", entry.group)
+        self._group = entry.group
+        timeout = self._timeout
+        self._set_timeout(self._cache.probe_timeout)
+        try:
+            if self.send_one_broadcast_message():
+                self._try_decode_data()
+        finally:
+            self._set_timeout(timeout)
+        if not self._decoder.success:
+            # stale: do not try it first again on the next discovery
+            self._cache.invalidate(self._decoder.kind, self._decoder.version)
+            self._group = None
+            return False
+        self._found_group = self._group
+        return True
+
+    def _probe_multicast_group(self):
+        """
+        Send one message to the multicast group (if any). Return True if it
+        was answered.
+        """
+        if (self._multicast_group is None) or (self._found_group is not None):
+            return False
+        self._group = self._get_group(self._multicast_group)
+        LOGGER.debug("probe multicast group %s", self._group)
+        if self.send_one_broadcast_message():
+            self._try_decode_data()
+        if not self._decoder.success:
+            self._group = None
+            return False
+        self._found_group = self._group
+        self._remember_group()
+        return True
+
+    def _get_interface_label(self, ip):
+        """
+        Return the name of the interface ip belongs to (ip if unknown).
+        """
+        if ip is None:
+            return None
+        label = self._interface_labels.get(ip)
+        if label is None:
+            interface = interfaces.find_interface(
+                self._inventory.interfaces(), ip)
+            label = ip if interface is None else interface.name
+            self._interface_labels[ip] = label
+        return label
+
+    def _count(self, name, ip=None):
+        self._metrics.increment(
+            name, self._get_interface_label(ip), self._decoder.kind.value)
+
+    def _count_reply(self, ip, rtt):
+        interface = self._get_interface_label(ip)
+        kind = self._decoder.kind.value
+        self._metrics.increment(metrics.REPLIES_RECEIVED, interface, kind)
+        self._metrics.observe(metrics.RTT_SECONDS, rtt, interface, kind)
+
+    def _record_result(self):
+        """
+        Tell the policy whether the interface of the current group answered.
+        """
+        if (self._policy is None) or (self._group is None):
+            return
+        ip, _ = self._group
+        interface = interfaces.find_interface(self._inventory.interfaces(), ip)
+        if interface is None:
+            return
+        if self._decoder.success:
+            self._policy.record_success(interface.broadcast, self._rtt)
+        else:
+            self._policy.record_failure(interface.broadcast)
+
+    def refresh_cache(self):
+        """
+        Record the last reply decoded in the cache again (for instance after a
+        keepalive) so that its entry does not expire while the server remains
+        available.
+        """
+        self._remember_group()
+
+    def _remember_group(self):
+        if (self._cache is not None) and self._decoder.success:
+            self._cache.put(
+                self._decoder.kind,
+                self._decoder.version,
+                self._group,
+                self._sender,
+                self._data)
+
+    def _set_timeout(self, timeout):
+        self._timeout = timeout
+        if self._udp_socket is not None:
+            self._udp_socket.settimeout(timeout)
+
+    def discover_all(self, window=None):
+        """
+        Send the message to every broadcast address at once and collect the
+        replies received during window seconds (timeout by default).
+        Return one Responder per distinct sender, lowest latency first.
+        """
+        if window is None:
+            window = self._timeout
+        groups = self._get_all_groups()
+        responders = {}
+        try:
+            self._start_probe()
+            start = self._transport.monotonic()
+            self._send_to_groups(groups)
+            deadline = start + window
+            while True:
+                received = self._receive_before(deadline)
+                if received is None:
+                    break
+                latency = self._transport.monotonic() - start
+                data, sender = received
+                self._count_reply(sender[0], latency)
+                responder = self._make_responder(sender, data, latency)
+                if responder and (sender not in responders):
+                    responders[sender] = responder
+        finally:
+            self._recycle_socket()
+        return sorted(responders.values(), key=lambda r: r.latency)
+
+    def _make_responder(self, sender, data, latency):
+        """
+        Decode the reply with a copy of the decoder, return None on failure.
+        """
+        decoder = copy.copy(self._decoder)
+        decoder.reset()
+        try:
+            decoder.decode(sender, data)
+        except DecodeError as ex:
+            LOGGER.warning(
+                "Could not decode %r from %s: %s", data, sender, ex)
+            self._count(metrics.DECODE_FAILURES, sender[0])
+        if not decoder.success:
+            return None
+        LOGGER.debug("%s answered in %.3fs", sender, latency)
+        return Responder(sender, decoder, latency)
+
+    def _get_all_groups(self):
+        """
+        Return all the groups of the interfaces in the order they would be
+        tried one by one.
+        """
+        self.reset()
+        groups = [self._get_group(ip) for ip in reversed(self._ips_pool)]
+        self._ips_pool = []
+        if self._multicast_group is not None:
+            groups.insert(0, self._get_group(self._multicast_group))
+        return groups
+
+    def _send_to_groups(self, groups):
+        for group in groups:
+            try:
+                self._socket.sendto(self._message, group)
+            except OSError as ex:
+                LOGGER.warning("Could not send to %s: %s", group, ex)
+            else:
+                self._count(metrics.PROBES_SENT, group[0])
+
+    def _receive_before(self, deadline):
+        """
+        Return the next (data, sender) received before deadline (as given by
+        the transport monotonic clock) or None if nothing arrived in time.
+        """
+        remaining = deadline - self._transport.monotonic()
+        if remaining <= 0:
+            return None
+        self._socket.settimeout(remaining)
+        try:
+            received = self._socket.recvfrom(self._size)
+        except socket.timeout:
+            return None
+        finally:
+            self._socket.settimeout(self._timeout)
+        if self._interrupted:
+            return None
+        return received
+
+    def _try_decode_data(self):
+        try:
+            self.decode_data()
+        except DecodeError as ex:
+            LOGGER.warning(
+                "Could not decode %r from %s: %s",
+                self._data, self._sender, ex)
+            self._count(metrics.DECODE_FAILURES, self._sender[0])
+
     def reset(self):
-        self._ips_pool = get_network_ips()
+        self._ips_pool = self._get_network_ips()
+
+    def _get_network_ips(self):
+        """
+        Same as get_network_ips but from the inventory.
+        """
+        entries = self._inventory.interfaces()
+        if self._policy is not None:
+            entries = self._policy.order(entries)
+        return [entry.broadcast for entry in entries][::-1]
+
+    def _on_interfaces_changed(self, interfaces, added):
+        """
+        Make sure the interfaces that just appeared (and that the policy
+        accepts) are tried next.
+        """
+        self._interface_labels = {}
+        if self._ips_pool is None:
+            return
+        for entry in added:
+            if (self._policy is not None) and not self._policy.accepts(entry):
+                continue
+            if entry.broadcast not in self._ips_pool:
+                self._ips_pool.append(entry.broadcast)
 
     def send_one_broadcast_message(self, silent=False):
         self._decoder.reset()
         self._received = False
+        if self._interrupted:
+            return False
         try:
+            self._start_probe()
             if not silent:
                 LOGGER.debug("before sendto")
+            start = self._transport.monotonic()
             sent = self._socket.sendto(self._message, self._group)
+            self._count(metrics.PROBES_SENT, self._group[0])
             if not silent:
-                LOGGER.debug("after sendto ; " + repr(sent))
+                LOGGER.debug("after sendto ; %r", sent)
+            deadline = start + self._timeout
             while not self._received:
-                try:
-                    self._data, self._sender = self._socket.recvfrom(
-                            self._size)
-                    self._received = True
-                except socket.timeout:
+                received = self._receive_before(deadline)
+                if self._interrupted:
+                    break
+                if received is None:
                     if not silent:
                         LOGGER.warning('timed out, no more responses')
+                    self._count(metrics.TIMEOUTS, self._group[0])
                     break
-                else:
-                    if not silent:
-                        LOGGER.info(
-                            'received "%s" from %s'
-                            % (repr(self._data), self._sender))
+                data, sender = received
+                if not self._is_fresh_reply(data, sender):
+                    continue
+                self._data, self._sender = received
+                self._rtt = self._transport.monotonic() - start
+                self._received = True
+                self._count_reply(self._group[0], self._rtt)
+                if not silent:
+                    LOGGER.info(
+                        'received "%r" from %s', self._data, self._sender)
         finally:
-            if not silent:
+            if not self._persistent and not silent:
                 LOGGER.info('closing socket')
-            self._socket.close()
-            self._build_socket()
+            self._recycle_socket()
         return self._received
 
     def decode_data(self):
@@ -285,68 +777,41 @@ class Broadcast(object):
     def decoder(self, value):
         self._decoder = value
 
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self._set_timeout(value)
+
+    def target_sender(self):
+        """
+        Send the next messages directly to the server that last replied
+        instead of broadcasting them.
+        """
+        if self._sender is not None:
+            sender_ip, _ = self._sender
+            self._group = self._get_group(sender_ip)
+
+    @property
+    def rtt(self):
+        """
+        Round-trip time in seconds of the last probe answered.
+        """
+        return self._rtt
+
     @property
     def remote_address(self):
         address, _ = self._sender
         return address
 
 
-async def send(sock, message, group):
-    LOGGER.debug("before sendto")
-    sent = sock.sendto(message, group)
-    LOGGER.debug("after sendto")
-    return sent
-
-
-async def recvfrom(sock, size):
-    LOGGER.debug("before recvfrom")
-    data, sender = sock.recvfrom(size)
-    LOGGER.debug("after recvfrom")
-    return data, sender
-
-
-class AsyncBroadcast(Broadcast):
-    def __init__(self, decoder, port=DEFAULT_PORT):
-        super().__init__(decoder, port, 0, 0)
-        self._ips_iterator = itertools.cycle(self._ips_pool)
-
-    async def async_send_all_broadcast_messages(self):
-        self._received = False
-        self._group = self._get_group(next(self._ips_iterator))
-        while True:
-            await self.async_send_one_broadcast_message()
-            if self._received:
-                self.decode_data()
-                break
-            self._group = self._get_group(next(self._ips_iterator))
-
-    async def async_send_one_broadcast_message(self):
-        try:
-            LOGGER.debug("before sendto")
-            task = asyncio.create_task(send(self._socket, self._message, self._group))
-            await task
-            sent = task.result()
-            LOGGER.debug("after sendto ; " + repr(sent))
-            tries = 10
-            while not self._received:
-                try:
-                    task = asyncio.create_task(recvfrom(self._socket, self._size))
-                    await task
-                    self._data, self._sender = task.result()
-                    self._received = True
-                except BlockingIOError as ex:
-                    pass
-                if not self._received:
-                    tries -= 1
-                    if tries <= 0:
-                        LOGGER.info("Failed to contact %s", self._group)
-                        break
-                    await asyncio.sleep(0.2)
-                else:
-                    LOGGER.info(
-                        'received "%s" from %s'
-                        % (repr(self._data), self._sender))
-        finally:
-            LOGGER.info('closing socket')
-            self._socket.close()
-            self._build_socket()
+def __getattr__(name):
+    # the asyncio flavour lives in its own module so that importing this one
+    # does not import asyncio
+    if "AsyncBroadcast" == name:
+        from orwell_common.async_broadcast import AsyncBroadcast
+        return AsyncBroadcast
+    raise AttributeError(
+        "module %r has no attribute %r" % (__name__, name))
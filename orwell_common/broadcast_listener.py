@@ -1,43 +1,163 @@
 import logging
+import selectors
 import socket
 import threading
 
-import orwell_common.logging
+import orwell_common.transport
+from orwell_common import codec
+from orwell_common import interfaces
+from orwell_common.port_pool import PortPool
 
 LOGGER = logging.getLogger(__name__.replace("orwell_common", "orwell.common"))
 
 
-class BroadcastListener(threading.Thread):
+class PortResponder(object):
     """
+    Compute the response to a broadcast message: the admin port for admin
+    messages and a port from the pool for robots. A robot keeps its port
+    when it broadcasts again (see PortPool).
+    Optionally the senders are rate limited (no response at all beyond the
+    limit) and duplicates get the response cached for the first message.
     """
 
     ADMIN = bytearray("admin", "ascii")
     ROBOT = bytearray("robot", "ascii")
 
-    def __init__(self, port=9081, admin_port=9082):
+    def __init__(
+            self,
+            admin_port=9082,
+            port_pool=None,
+            rate_limiter=None,
+            reply_cache=None):
         """
+        port_pool: PortPool to take the robot ports from (by default an
+        empty one with leases that never expire).
+        rate_limiter: throttle.RateLimiter applied to the ip of the senders,
+        None to answer everything.
+        reply_cache: throttle.ReplyCache of the responses, None to compute
+        each response.
         """
-        threading.Thread.__init__(self)
-        self._socket_ports = []
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self._socket.bind(('', port))
+        if port_pool is None:
+            port_pool = PortPool()
+        self._port_pool = port_pool
         self._admin_port = admin_port
+        self._rate_limiter = rate_limiter
+        self._reply_cache = reply_cache
 
     def add_socket_port(self, socket_port):
-        self._socket_ports.append(socket_port)
+        self._port_pool.add_port(socket_port)
+
+    def release_robot(self, address):
+        """
+        Give back the port used by the robot at address.
+        """
+        ip, _ = address
+        self._port_pool.release(ip)
+        if self._reply_cache is not None:
+            self._reply_cache.invalidate(ip)
 
-    def _get_robot_port(self):
-        if self._socket_ports:
-            port = self._socket_ports.pop(0)
-            data = bytearray("{local_port}".format(local_port=port), "ascii")
+    def _get_robot_port(self, address=None):
+        key = None if address is None else address[0]
+        port = self._port_pool.allocate(key)
+        if port is not None:
+            data = codec.encode(
+                codec.Kind.PROXY_ROBOTS, "robot", codec.ProxyRobotsAdvert(port))
         else:
             data = b"Goodbye"
         return data
 
     def _get_admin_port(self):
-        data = bytearray("{admin_port}".format(admin_port=self._admin_port), "ascii")
+        return codec.encode(
+            codec.Kind.PROXY_ROBOTS, "admin",
+            codec.ProxyRobotsAdvert(self._admin_port))
+
+    def respond(self, message, address):
+        """
+        Return the data to send back to address in response to message, or
+        None if the sender is over its rate limit.
+        """
+        if self._rate_limiter is not None:
+            ip, _ = address
+            if not self._rate_limiter.allow(ip):
+                LOGGER.debug("Rate limited %s", address)
+                return None
+        if self._reply_cache is None:
+            return self._compute_response(message, address)
+        # keyed by ip: a retry may come from another port
+        ip, _ = address
+        data = self._reply_cache.get(message, ip)
+        if data is None:
+            data = self._compute_response(message, address)
+            self._reply_cache.put(message, ip, data)
         return data
 
+    def _compute_response(self, message, address):
+        if message.startswith(PortResponder.ADMIN):
+            return self._get_admin_port()
+        elif message.startswith(PortResponder.ROBOT):
+            return self._get_robot_port(address)
+        else:
+            return self._get_robot_port(address)
+
+
+def _join_multicast_group(sock, group, inventory, policy):
+    if inventory is None:
+        inventory = interfaces.get_default_inventory()
+    entries = inventory.interfaces()
+    if policy is not None:
+        entries = [entry for entry in entries if policy.accepts(entry)]
+    interfaces.join_multicast_group(sock, group, entries)
+
+
+class BroadcastListener(threading.Thread, PortResponder):
+    """
+    """
+
+    def __init__(
+            self,
+            port=9081,
+            admin_port=9082,
+            port_pool=None,
+            transport=None,
+            receive_buffer=None,
+            rate_limiter=None,
+            reply_cache=None,
+            multicast_group=None,
+            inventory=None,
+            multicast_policy=None):
+        """
+        rate_limiter, reply_cache: see PortResponder.
+        multicast_group: if not None multicast group (see
+        broadcast.DEFAULT_MULTICAST_GROUP) to answer to as well.
+        inventory: InterfaceInventory giving the interfaces joining the group.
+        multicast_policy: InterfacePolicy selecting the interfaces joining the
+        group (all of them by default).
+        transport: where the socket comes from (transport.SYSTEM by default).
+        receive_buffer: size in bytes of the kernel receive buffer (SO_RCVBUF)
+        or None to keep the system default.
+        """
+        threading.Thread.__init__(self)
+        PortResponder.__init__(
+            self, admin_port, port_pool, rate_limiter, reply_cache)
+        if transport is None:
+            transport = orwell_common.transport.SYSTEM
+        self._socket = transport.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if receive_buffer is not None:
+            self._socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+        self._socket.bind(('', port))
+        if multicast_group is not None:
+            _join_multicast_group(
+                self._socket, multicast_group, inventory, multicast_policy)
+
+    @property
+    def port(self):
+        """
+        Port the listener is bound to.
+        """
+        _, port = self._socket.getsockname()
+        return port
+
     def run(self, max_loops=0):
         """
         max_loops: if greater than zero maximum number of loops performed
@@ -57,20 +177,249 @@ class BroadcastListener(threading.Thread):
             if message:
                 try:
                     LOGGER.info(
-                            "Received UDP broadcast '{message}' "
-                            "from {address}".format(
-                                message=message, address=address))
-                    if message.startswith(BroadcastListener.ADMIN):
-                        method = self._get_admin_port
-                    elif message.startswith(BroadcastListener.ROBOT):
-                        method = self._get_robot_port
-                    else:
-                        method = self._get_robot_port
-                    data = method()
-                    LOGGER.info("Try to send response to broadcast: {data}".format(data=data))
+                            "Received UDP broadcast '%s' from %s",
+                            message, address)
+                    data = self.respond(message, address)
+                    if data is None:
+                        continue
+                    LOGGER.info("Try to send response to broadcast: %s", data)
                     self._socket.sendto(data, address)
                     LOGGER.info("Success")
                 except socket.timeout:
                     LOGGER.info("Tried to send response but socket.timeout occurred")
                 except BlockingIOError:
                     LOGGER.info("Tried to send response but BlockingIOError occurred")
+
+
+class BatchBroadcastListener(BroadcastListener):
+    """
+    BroadcastListener for bursts of messages (a whole fleet powering on):
+    each loop waits for the socket to be readable then answers everything
+    waiting, up to batch_size messages, with one recvmmsg and one sendmmsg
+    when available (see batch_io). Needs a real socket. The sockets are
+    closed when run returns.
+    """
+
+    def __init__(
+            self,
+            port=9081,
+            admin_port=9082,
+            port_pool=None,
+            receive_buffer=1 << 20,
+            batch_size=64,
+            rate_limiter=None,
+            reply_cache=None,
+            multicast_group=None,
+            inventory=None,
+            multicast_policy=None):
+        """
+        receive_buffer: size in bytes of the kernel receive buffer, large by
+        default to absorb bursts (the system may cap it, see rmem_max).
+        batch_size: maximum number of messages handled per system call.
+        """
+        BroadcastListener.__init__(
+            self, port, admin_port, port_pool, receive_buffer=receive_buffer,
+            rate_limiter=rate_limiter, reply_cache=reply_cache,
+            multicast_group=multicast_group, inventory=inventory,
+            multicast_policy=multicast_policy)
+        # imported here so that only the batch users pay for ctypes
+        from orwell_common.batch_io import DatagramBatcher
+        self._socket.setblocking(False)
+        self._batcher = DatagramBatcher(self._socket, batch_size)
+        # a selector rather than select.select that cannot wait for file
+        # descriptors above 1024
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._socket, selectors.EVENT_READ)
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ)
+        # guards the wakeup writer against stop racing with close
+        self._lock = threading.Lock()
+        self._stopped = False
+        LOGGER.debug(
+            "batch listener on port %s (mmsg: %s, SO_RCVBUF: %s)",
+            self.port, self._batcher.uses_mmsg,
+            self._socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF))
+
+    def run(self, max_loops=0):
+        """
+        max_loops: if greater than zero maximum number of batches handled
+        before exiting, otherwise ignored.
+        """
+        loops = 0
+        try:
+            while (not self._stopped) and (
+                    (max_loops <= 0) or (loops < max_loops)):
+                for key, _ in self._selector.select():
+                    if key.fileobj is self._wakeup_reader:
+                        self._wakeup_reader.recv(64)
+                        continue
+                    if max_loops > 0:
+                        loops += 1
+                    self._serve_batch()
+        finally:
+            self.close()
+
+    def stop(self):
+        """
+        Make run return as soon as possible (from any thread).
+        """
+        self._stopped = True
+        with self._lock:
+            if self._wakeup_writer is None:
+                return
+            try:
+                self._wakeup_writer.send(b"\0")
+            except OSError as ex:
+                LOGGER.debug("could not wake up listener: %s", ex)
+
+    def close(self):
+        """
+        Close the socket and the selector. The listener cannot be used
+        afterwards.
+        """
+        with self._lock:
+            if self._selector is None:
+                return
+            self._selector.close()
+            self._selector = None
+            self._socket.close()
+            self._wakeup_reader.close()
+            self._wakeup_reader = None
+            self._wakeup_writer.close()
+            self._wakeup_writer = None
+
+    def _serve_batch(self):
+        """
+        Answer the messages waiting on the socket and return how many there
+        were.
+        """
+        messages = self._batcher.receive()
+        if not messages:
+            return 0
+        LOGGER.debug("Received %s UDP broadcasts", len(messages))
+        replies = []
+        for message, address in messages:
+            if message:
+                data = self.respond(message, address)
+                if data is not None:
+                    replies.append((data, address))
+        sent = self._batcher.send(replies)
+        if sent < len(replies):
+            LOGGER.info(
+                "Socket full, %s responses not sent", len(replies) - sent)
+        return len(messages)
+
+
+class SelectorBroadcastListener(threading.Thread):
+    """
+    Answer broadcast messages on any number of ports from a single thread.
+    Each port has its own responder: a callable taking the message and the
+    address of the sender and returning the data to send back (or None to
+    stay silent), like PortResponder.respond.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ)
+        # guards the wakeup writer against stop racing with close
+        self._lock = threading.Lock()
+        self._sockets = []
+        self._stopped = False
+
+    def add_port(self, port, responder):
+        """
+        Bind a socket on port (0 to let the system choose) and answer the
+        messages it receives with responder. Return the port bound.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sock.bind(('', port))
+        self._sockets.append(sock)
+        self._selector.register(sock, selectors.EVENT_READ, responder)
+        _, bound_port = sock.getsockname()
+        return bound_port
+
+    def stop(self):
+        """
+        Make run return as soon as possible (from any thread).
+        """
+        self._stopped = True
+        with self._lock:
+            if self._wakeup_writer is None:
+                return
+            try:
+                self._wakeup_writer.send(b"\0")
+            except OSError as ex:
+                LOGGER.debug("could not wake up listener: %s", ex)
+
+    def close(self):
+        """
+        Close the sockets and the selector. The listener cannot be used
+        afterwards.
+        """
+        with self._lock:
+            if self._selector is None:
+                return
+            for sock in self._sockets:
+                self._selector.unregister(sock)
+                sock.close()
+            self._sockets = []
+            self._selector.close()
+            self._selector = None
+            self._wakeup_reader.close()
+            self._wakeup_reader = None
+            self._wakeup_writer.close()
+            self._wakeup_writer = None
+
+    def run(self, max_loops=0):
+        """
+        max_loops: if greater than zero maximum number of messages handled
+        before exiting, otherwise ignored.
+        """
+        loops = 0
+        try:
+            while not self._stopped:
+                for key, _ in self._selector.select():
+                    if key.fileobj is self._wakeup_reader:
+                        self._wakeup_reader.recv(64)
+                        continue
+                    if self._serve(key.fileobj, key.data):
+                        loops += 1
+                    if (max_loops > 0) and (loops >= max_loops):
+                        return
+        finally:
+            self.close()
+
+    def _serve(self, sock, responder):
+        """
+        Answer one message waiting on sock. Return True if there was one.
+        """
+        try:
+            message, address = sock.recvfrom(4096)
+        except BlockingIOError:
+            return False
+        if not message:
+            # like BroadcastListener, an empty datagram is not a request
+            return True
+        LOGGER.debug("Received UDP broadcast %s from %s", message, address)
+        data = responder(message, address)
+        if data is not None:
+            try:
+                sock.sendto(data, address)
+            except BlockingIOError:
+                LOGGER.info(
+                    "Tried to send response but BlockingIOError occurred")
+        return True
+
+
+def __getattr__(name):
+    # see broadcast.__getattr__
+    if "AsyncBroadcastListener" == name:
+        from orwell_common.async_broadcast_listener import AsyncBroadcastListener
+        return AsyncBroadcastListener
+    raise AttributeError(
+        "module %r has no attribute %r" % (__name__, name))
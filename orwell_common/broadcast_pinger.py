@@ -1,34 +1,156 @@
-import orwell_common.logging
 import orwell_common.broadcast as broadcast
+import orwell_common.transport
 
+import collections
+import enum
 import logging
-import time
 import threading
 
 LOGGER = logging.getLogger(__name__.replace("orwell_common", "orwell.common"))
 
 
+class EventType(enum.Enum):
+    FOUND = "found"
+    LOST = "lost"
+    CHANGED = "changed"
+    STOPPED = "stopped"
+
+
+PingerEvent = collections.namedtuple("PingerEvent", ("type", "kind", "payload"))
+PingerEvent.__doc__ = """
+Something that happened to the server followed by a BroadcastPinger. The
+payload is what is put in the message queue: (push, subscribe, reply)
+addresses for a ServerGame, (port,) for a ProxyRobots and None when the
+server is lost or the pinger stopped.
+"""
+
+
+def get_payload(decoder):
+    """
+    Return what is reported about the server decoder decoded (see
+    PingerEvent).
+    """
+    if broadcast.Kind.SERVER_GAME == decoder.kind:
+        return (
+            decoder.push_address,
+            decoder.subscribe_address,
+            decoder.reply_address)
+    else:
+        assert(broadcast.Kind.PROXY_ROBOTS == decoder.kind)
+        return (decoder.port,)
+
+
 class BroadcastPinger(threading.Thread):
     """
     Send broadcast messages periodically to first find the server and check that
     it remains available. Start from scratch when the server becomes unavailable.
+
+    What happens is reported in the message queue (if any) and to the
+    callbacks registered with add_callback, or can be iterated over with
+    async for event in pinger.events().
     """
 
     def __init__(
             self,
             message_queue,
             sleep_duration=4,
-            decoder=broadcast.ServerGameDecoder(),
+            decoder=None,
             port=broadcast.DEFAULT_PORT,
             retries=2,
-            timeout=3):
+            timeout=3,
+            parallel=False,
+            cache=None,
+            scheduler=None,
+            inventory=None,
+            transport=None):
         """
+        message_queue: queue receiving the payloads (see PingerEvent), can be
+        None.
+        decoder: decoder of the replies of the server looked for (a new
+        ServerGameDecoder by default).
+        parallel: if True look for the server on all interfaces at once.
+        cache: DiscoveryCache used to find the server again quickly.
+        scheduler: AdaptiveScheduler giving the timeout and the delay between
+        probes (instead of timeout and sleep_duration). Once in contact the
+        probes are then sent directly to the server, which is only lost once
+        the scheduler says so.
+        inventory: InterfaceInventory giving the broadcast addresses.
+        transport: where sockets and time come from (transport.SYSTEM by
+        default, see simulation.Fabric).
         """
         threading.Thread.__init__(self)
+        if transport is None:
+            transport = orwell_common.transport.SYSTEM
+        self._transport = transport
+        if decoder is None:
+            decoder = broadcast.ServerGameDecoder()
         self._message_queue = message_queue
         self._sleep_duration = sleep_duration
         self._kind = decoder.kind
-        self._broadcaster = broadcast.Broadcast(decoder, port, retries, timeout)
+        self._scheduler = scheduler
+        self._broadcaster = broadcast.Broadcast(
+            decoder, port, retries, timeout,
+            parallel=parallel, persistent=True, cache=cache,
+            inventory=inventory, transport=transport)
+        self._stop_event = threading.Event()
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+        self._stopped = False
+        self._payload = None
+
+    def add_callback(self, callback, event_types=None):
+        """
+        Call callback(event) from the pinger thread for each PingerEvent whose
+        type is in event_types (all of them if None).
+        """
+        with self._callbacks_lock:
+            self._callbacks.append((callback, event_types))
+
+    def remove_callback(self, callback):
+        with self._callbacks_lock:
+            self._callbacks = [
+                (registered, event_types)
+                for registered, event_types in self._callbacks
+                if registered is not callback]
+
+    def stop(self):
+        """
+        Make run return as soon as possible (from any thread).
+        """
+        self._stop_event.set()
+        self._broadcaster.interrupt()
+
+    def events(self):
+        """
+        Asynchronously iterate over the events produced from the call on
+        until the pinger stops (nothing if it already has). Must be called
+        from a running event loop.
+        """
+        # imported here so that only the asyncio users pay for it
+        import asyncio
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def callback(event):
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+        # registered now rather than at the first iteration so that no event
+        # is missed, and checked against run ending under the same lock
+        with self._callbacks_lock:
+            self._callbacks.append((callback, None))
+            if self._stopped:
+                events.put_nowait(PingerEvent(EventType.STOPPED, self._kind, None))
+        return self._iterate_events(events, callback)
+
+    async def _iterate_events(self, events, callback):
+        try:
+            while True:
+                event = await events.get()
+                if EventType.STOPPED == event.type:
+                    break
+                yield event
+        finally:
+            self.remove_callback(callback)
 
     def run(self, max_loops=0):
         """
@@ -37,33 +159,98 @@ class BroadcastPinger(threading.Thread):
         """
         loops = 0
         found = False
-        while (max_loops <= 0) or (loops < max_loops):
-            if max_loops > 0:
-                loops += 1
-            if not found:
-                self._broadcaster.send_all_broadcast_messages()
-                answer_received = self._broadcaster.decoder.success
-            else:
-                answer_received = self._broadcaster.send_one_broadcast_message()
-            if answer_received:
+        with self._callbacks_lock:
+            self._stopped = False
+        try:
+            while (max_loops <= 0) or (loops < max_loops):
+                if self._stop_event.is_set():
+                    break
+                if max_loops > 0:
+                    loops += 1
+                if self._scheduler is not None:
+                    self._broadcaster.timeout = self._scheduler.timeout
                 if not found:
-                    found = True
-                    LOGGER.info("Made contact with %s.", self._kind.value)
-                    if broadcast.Kind.SERVER_GAME == self._kind:
-                        push_address = self._broadcaster.decoder.push_address
-                        subscribe_address = self._broadcaster.decoder.subscribe_address
-                        replier_address = self._broadcaster.decoder.reply_address
-                        self._message_queue.put(
-                            (push_address, subscribe_address, replier_address))
-                    else:
-                        assert(broadcast.Kind.PROXY_ROBOTS == self._kind)
-                        robot_port = self._broadcaster.port
-                        self._message_queue.put((robot_port,))
-            else:
-                if found:
-                    LOGGER.info("Contact lost with %s.", self._kind.value)
-                    self._message_queue.put(None)
+                    self._broadcaster.send_all_broadcast_messages()
+                    answer_received = self._broadcaster.decoder.success
+                else:
+                    answer_received = self._broadcaster.send_one_broadcast_message()
+                    if answer_received:
+                        self._decode_keepalive()
+                if self._stop_event.is_set():
+                    break
+                self._update_scheduler(answer_received)
+                if answer_received:
+                    payload = get_payload(self._broadcaster.decoder)
+                    if not found:
+                        found = True
+                        LOGGER.info("Made contact with %s.", self._kind.value)
+                        self._notify(EventType.FOUND, payload)
+                    elif payload != self._payload:
+                        LOGGER.info("%s changed.", self._kind.value)
+                        self._notify(EventType.CHANGED, payload)
+                    self._payload = payload
+                elif found and not self._is_lost():
+                    LOGGER.debug("%s missed a keepalive.", self._kind.value)
                 else:
-                    LOGGER.info("Could not find %s.", self._kind.value)
-                found = False
-            time.sleep(self._sleep_duration)
+                    if found:
+                        LOGGER.info("Contact lost with %s.", self._kind.value)
+                        self._notify(EventType.LOST, None)
+                    else:
+                        LOGGER.info("Could not find %s.", self._kind.value)
+                    found = False
+                    self._payload = None
+                self._transport.wait(
+                    self._stop_event, self._get_sleep_duration())
+        finally:
+            self._broadcaster.close()
+            with self._callbacks_lock:
+                self._stopped = True
+            self._notify(EventType.STOPPED, None)
+
+    def _decode_keepalive(self):
+        """
+        Decode the reply to a keepalive to notice a change of addresses and
+        keep the cache (if any) up to date.
+        """
+        try:
+            self._broadcaster.decode_data()
+        except broadcast.DecodeError as ex:
+            LOGGER.warning("Could not decode keepalive reply: %s", ex)
+            return
+        self._broadcaster.refresh_cache()
+
+    def _notify(self, event_type, payload):
+        event = PingerEvent(event_type, self._kind, payload)
+        if (self._message_queue is not None) and (EventType.STOPPED != event_type):
+            self._message_queue.put(payload)
+        with self._callbacks_lock:
+            callbacks = list(self._callbacks)
+        for callback, event_types in callbacks:
+            if (event_types is None) or (event_type in event_types):
+                try:
+                    callback(event)
+                except Exception:
+                    LOGGER.exception("Callback failed for %s", event)
+
+    def _update_scheduler(self, answer_received):
+        if self._scheduler is None:
+            return
+        if answer_received:
+            self._scheduler.on_success(self._broadcaster.rtt)
+            self._broadcaster.target_sender()
+        else:
+            self._scheduler.on_failure()
+
+    def _is_lost(self):
+        """
+        Return True if the server in contact must be considered lost after an
+        unanswered probe (at once without scheduler).
+        """
+        if self._scheduler is None:
+            return True
+        return self._scheduler.lost
+
+    def _get_sleep_duration(self):
+        if self._scheduler is None:
+            return self._sleep_duration
+        return self._scheduler.next_interval()
@@ -0,0 +1,246 @@
+"""
+Wire format of the discovery.
+
+A client broadcasts the version of the reply it understands as ascii (for
+instance b"2" for a ServerGame, b"robot" for a ProxyRobots) and the server
+replies with the layout registered for (Kind, version), or the nearest
+one for a version without its own layout (see get_codec):
+
+- ProxyRobots ("robot" and "admin"): the port as ascii digits.
+- ServerGame: a sequence of records (tag on 1 byte, size of the value on 1
+  byte, value) ended by a 0x00 tag or the end of the data. Version 1 needs
+  the 0xA0 to 0xA2 addresses, version 2 also needs the 0xA3 one. Version 3
+  adds optional fields (load, capacity, game id). Records with an unknown
+  tag are skipped so that fields can be added without breaking older
+  clients, and the encoder writes the addresses first so that a version 3
+  reply is also a valid version 2 reply.
+"""
+import collections
+import enum
+import struct
+import sys
+
+
+class Kind(enum.Enum):
+    SERVER_GAME = "ServerGame"
+    PROXY_ROBOTS = "ProxyRobots"
+
+
+class DecodeError(ValueError):
+    """
+    Raised when the reply to a broadcast message is malformed.
+    """
+
+
+ServerGameAdvert = collections.namedtuple(
+    "ServerGameAdvert",
+    ("push_address", "subscribe_address", "reply_address", "agent_address",
+     "load", "capacity", "game_id"),
+    defaults=(None, None, None, None))
+ServerGameAdvert.__doc__ = """
+What a ServerGame advertises. The addresses may contain '*' standing for the
+ip of the server. load and capacity count players, game_id names the game.
+"""
+
+ProxyRobotsAdvert = collections.namedtuple("ProxyRobotsAdvert", ("port",))
+
+_RECORD = struct.Struct("BB")
+_END_TAG = 0x00
+_UINT16 = struct.Struct("!H")
+
+
+def _decode_text(value):
+    return sys.intern(str(value, "ascii"))
+
+
+def _encode_text(value):
+    return value.encode("ascii")
+
+
+def _decode_uint16(value):
+    if len(value) != _UINT16.size:
+        raise ValueError("expected %d bytes" % _UINT16.size)
+    return _UINT16.unpack(value)[0]
+
+
+# tag, field, decode, encode
+_SERVER_GAME_FIELDS = (
+    (0xa0, "push_address", _decode_text, _encode_text),
+    (0xa1, "subscribe_address", _decode_text, _encode_text),
+    (0xa2, "reply_address", _decode_text, _encode_text),
+    (0xa3, "agent_address", _decode_text, _encode_text),
+    (0xa4, "load", _decode_uint16, _UINT16.pack),
+    (0xa5, "capacity", _decode_uint16, _UINT16.pack),
+    (0xa6, "game_id", _decode_text, _encode_text),
+)
+
+
+class TlvCodec(object):
+    """
+    Records (see the module documentation) of the fields of a namedtuple.
+    """
+
+    def __init__(self, kind, version, advert_class, fields, required):
+        """
+        fields: (tag, field, decode, encode) of the fields known by this
+        version, in the order they are written.
+        required: names of the fields that must be present.
+        """
+        self._kind = kind
+        self._version = version
+        self._advert_class = advert_class
+        self._fields = fields
+        self._by_tag = {field[0]: field for field in fields}
+        self._required = required
+
+    @property
+    def kind(self):
+        return self._kind
+
+    @property
+    def version(self):
+        return self._version
+
+    def encode(self, advert):
+        chunks = []
+        for tag, name, _, encode in self._fields:
+            value = getattr(advert, name)
+            if value is None:
+                continue
+            encoded = encode(value)
+            if len(encoded) > 0xff:
+                raise ValueError("%s too long: %r" % (name, value))
+            chunks.append(_RECORD.pack(tag, len(encoded)))
+            chunks.append(encoded)
+        chunks.append(bytes((_END_TAG,)))
+        return b"".join(chunks)
+
+    def decode(self, data):
+        view = memoryview(data)
+        length = len(view)
+        values = {}
+        offset = 0
+        while offset < length:
+            if _END_TAG == view[offset]:
+                break
+            if offset + _RECORD.size > length:
+                raise DecodeError(
+                    "Record header truncated at offset %d in %r" %
+                    (offset, bytes(data)))
+            tag, size = _RECORD.unpack_from(view, offset)
+            start = offset + _RECORD.size
+            offset = start + size
+            if offset > length:
+                raise DecodeError(
+                    "Record 0x%x of size %d truncated in %r" %
+                    (tag, size, bytes(data)))
+            field = self._by_tag.get(tag)
+            if field is None:
+                continue
+            _, name, decode, _ = field
+            try:
+                values[name] = decode(view[start:offset])
+            except ValueError as ex:
+                raise DecodeError(
+                    "Record 0x%x is invalid in %r" % (tag, bytes(data))) from ex
+        for name in self._required:
+            if name not in values:
+                raise DecodeError("Missing %s in %r" % (name, bytes(data)))
+        return self._advert_class(**values)
+
+
+class PortCodec(object):
+    """
+    A port as ascii digits.
+    """
+
+    def __init__(self, kind, version):
+        self._kind = kind
+        self._version = version
+
+    @property
+    def kind(self):
+        return self._kind
+
+    @property
+    def version(self):
+        return self._version
+
+    def encode(self, advert):
+        return str(advert.port).encode("ascii")
+
+    def decode(self, data):
+        try:
+            return ProxyRobotsAdvert(int(bytes(data)))
+        except ValueError as ex:
+            raise DecodeError("Invalid port %r" % (bytes(data),)) from ex
+
+
+_CODECS = {}
+
+
+def register(codec):
+    """
+    Make codec the one used for its (kind, version), replacing any previous
+    one.
+    """
+    _CODECS[(codec.kind, codec.version)] = codec
+
+
+def get_codec(kind, version):
+    """
+    Return the codec registered for (kind, version), or else the nearest
+    one: the port for any ProxyRobots version and the highest version below
+    for a ServerGame. Raise DecodeError if there is none.
+    """
+    codec = _CODECS.get((kind, version))
+    if codec is None:
+        codec = _get_nearest_codec(kind, version)
+    if codec is None:
+        raise DecodeError(
+            "No codec for %s version %r" % (kind.value, version))
+    return codec
+
+
+def _get_nearest_codec(kind, version):
+    if Kind.PROXY_ROBOTS == kind:
+        # whatever the version the reply is a port
+        return _CODECS.get((kind, "robot"))
+    if isinstance(version, bool) or not isinstance(version, int):
+        return None
+    lower = [
+        known for known_kind, known in _CODECS
+        if (known_kind == kind) and isinstance(known, int) and
+        (known <= version)]
+    if not lower:
+        return None
+    return _CODECS[(kind, max(lower))]
+
+
+def encode(kind, version, advert):
+    return get_codec(kind, version).encode(advert)
+
+
+def decode(kind, version, data):
+    return get_codec(kind, version).decode(data)
+
+
+def encode_request(version):
+    """
+    Return the broadcast message asking for replies of version.
+    """
+    return str(version).encode("ascii")
+
+
+_ADDRESSES = ("push_address", "subscribe_address", "reply_address")
+register(TlvCodec(
+    Kind.SERVER_GAME, 1, ServerGameAdvert, _SERVER_GAME_FIELDS[:4],
+    _ADDRESSES))
+register(TlvCodec(
+    Kind.SERVER_GAME, 2, ServerGameAdvert, _SERVER_GAME_FIELDS[:4],
+    _ADDRESSES + ("agent_address",)))
+register(TlvCodec(
+    Kind.SERVER_GAME, 3, ServerGameAdvert, _SERVER_GAME_FIELDS,
+    _ADDRESSES + ("agent_address",)))
+register(PortCodec(Kind.PROXY_ROBOTS, "robot"))
+register(PortCodec(Kind.PROXY_ROBOTS, "admin"))
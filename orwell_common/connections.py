@@ -0,0 +1,173 @@
+"""
+ZeroMQ sockets to the ServerGame found by the discovery, connected as soon
+as it is found so that the first message does not wait for the connection.
+"""
+import collections
+import logging
+import threading
+
+import zmq
+
+from orwell_common.broadcast_pinger import EventType
+from orwell_common.codec import Kind
+
+LOGGER = logging.getLogger(__name__.replace("orwell_common", "orwell.common"))
+
+ServerConnections = collections.namedtuple(
+    "ServerConnections", ("pusher", "subscriber", "requester"))
+ServerConnections.__doc__ = """
+PUSH, SUB and REQ sockets connected to the push, subscribe and reply
+addresses of a ServerGame.
+"""
+
+
+class ConnectionManager(object):
+    """
+    Sockets to the current ServerGame, cached by type and endpoint: when the
+    pinger finds the server again at an address already known the sockets
+    connected to it are reused, ZeroMQ having reconnected them in the
+    background. When the addresses change the new sockets are connected
+    first and then replace the current ones in one go.
+
+    ZeroMQ sockets are not thread safe: each one must be used by a single
+    thread at a time, so take current again after each change rather than
+    keeping the sockets around. For the same reason the sockets evicted by
+    connect (called from the pinger thread) are only closed by the thread
+    using them, when it takes current or calls collect.
+    """
+
+    def __init__(
+            self,
+            context=None,
+            subscriptions=(b"",),
+            reconnect_interval=0.1,
+            max_endpoints=8):
+        """
+        context: zmq.Context to create the sockets with (the one shared by
+        the process, zmq.Context.instance(), by default).
+        subscriptions: topics the SUB sockets subscribe to.
+        reconnect_interval: delay in seconds between two attempts to
+        reconnect to a server that went away.
+        max_endpoints: number of sockets kept open, the least recently used
+        ones are closed first (never the current ones).
+        """
+        if context is None:
+            context = zmq.Context.instance()
+        self._context = context
+        self._subscriptions = subscriptions
+        self._reconnect_interval = reconnect_interval
+        self._max_endpoints = max_endpoints
+        # (socket type, endpoint) -> socket, least recently used first
+        self._sockets = collections.OrderedDict()
+        # sockets evicted but not closed yet (see collect)
+        self._evicted = []
+        self._current = None
+        self._lock = threading.Lock()
+
+    @property
+    def context(self):
+        return self._context
+
+    @property
+    def current(self):
+        """
+        ServerConnections to the current server (None before the first one
+        is found). Closes the sockets evicted since the last call.
+        """
+        self.collect()
+        return self._current
+
+    def attach(self, pinger):
+        """
+        Connect to the servers found by pinger (a BroadcastPinger looking for
+        a ServerGame).
+        """
+        pinger.add_callback(
+            self.on_event, (EventType.FOUND, EventType.CHANGED))
+
+    def on_event(self, event):
+        """
+        Callback for BroadcastPinger.add_callback.
+        """
+        if Kind.SERVER_GAME != event.kind:
+            return
+        if event.type in (EventType.FOUND, EventType.CHANGED):
+            self.connect(*event.payload)
+
+    def connect(self, push_address, subscribe_address, reply_address):
+        """
+        Make sockets connected to the addresses the current ones and return
+        them as ServerConnections.
+        """
+        with self._lock:
+            connections = ServerConnections(
+                self._get_socket(zmq.PUSH, push_address),
+                self._get_socket(zmq.SUB, subscribe_address),
+                self._get_socket(zmq.REQ, reply_address))
+            if connections != self._current:
+                LOGGER.info(
+                    "Connected to %s %s %s",
+                    push_address, subscribe_address, reply_address)
+            self._current = connections
+            self._evict()
+            return connections
+
+    def collect(self):
+        """
+        Close the sockets evicted since the last call. Must be called from
+        the thread using the sockets.
+        """
+        with self._lock:
+            evicted = self._evicted
+            self._evicted = []
+        for sock in evicted:
+            sock.close(linger=0)
+
+    def close(self):
+        """
+        Close all the sockets (the context is left alone).
+        """
+        with self._lock:
+            for sock in self._sockets.values():
+                sock.close(linger=0)
+            self._sockets.clear()
+            self._current = None
+        self.collect()
+
+    def _get_socket(self, socket_type, endpoint):
+        key = (socket_type, endpoint)
+        sock = self._sockets.pop(key, None)
+        if sock is None:
+            sock = self._build_socket(socket_type)
+            sock.connect(endpoint)
+            LOGGER.debug("Connecting %s to %s", socket_type, endpoint)
+        self._sockets[key] = sock
+        return sock
+
+    def _build_socket(self, socket_type):
+        sock = self._context.socket(socket_type)
+        sock.setsockopt(zmq.LINGER, 0)
+        interval = int(self._reconnect_interval * 1000)
+        sock.setsockopt(zmq.RECONNECT_IVL, interval)
+        sock.setsockopt(zmq.RECONNECT_IVL_MAX, max(interval, 1000))
+        if zmq.SUB == socket_type:
+            for subscription in self._subscriptions:
+                sock.setsockopt(zmq.SUBSCRIBE, subscription)
+        elif zmq.REQ == socket_type:
+            # a server restarting must not leave the socket waiting for a
+            # reply that will never come
+            sock.setsockopt(zmq.REQ_RELAXED, 1)
+            sock.setsockopt(zmq.REQ_CORRELATE, 1)
+        return sock
+
+    def _evict(self):
+        current = set(self._current)
+        for key in list(self._sockets):
+            if len(self._sockets) <= self._max_endpoints:
+                break
+            sock = self._sockets[key]
+            if sock in current:
+                continue
+            LOGGER.debug("Evicting %s to %s", *key)
+            del self._sockets[key]
+            self._evicted.append(sock)
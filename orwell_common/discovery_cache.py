@@ -0,0 +1,127 @@
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__.replace("orwell_common", "orwell.common"))
+
+CacheEntry = collections.namedtuple(
+    "CacheEntry", ("group", "sender", "data", "timestamp"))
+CacheEntry.__doc__ = """
+Last successful discovery: the group that answered, the sender of the
+reply, the raw reply (enough to decode the endpoints again) and when it was
+received (as given by time.time).
+"""
+
+
+class DiscoveryCache(object):
+    """
+    Remember where each kind of server was last found so that a new
+    discovery can first try again there with a short timeout instead of
+    scanning every interface. Entries are keyed by Kind and decoder version
+    and expire after ttl seconds. They can be saved to a small json file to
+    survive a restart.
+    """
+
+    def __init__(self, ttl=300, path=None, probe_timeout=0.5, clock=time.time):
+        """
+        ttl: lifetime of an entry in seconds.
+        path: file where the entries are persisted (None to keep them in
+        memory only).
+        probe_timeout: timeout in seconds when probing a cached group.
+        clock: function returning the current time in seconds.
+        """
+        self._ttl = ttl
+        self._path = path
+        self._probe_timeout = probe_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = {}
+        if self._path is not None:
+            self._load()
+
+    @staticmethod
+    def _get_key(kind, version):
+        return "%s/%s" % (kind.value, version)
+
+    @property
+    def probe_timeout(self):
+        return self._probe_timeout
+
+    def get(self, kind, version):
+        """
+        Return the CacheEntry for kind and version or None if there is none
+        or it expired.
+        """
+        key = DiscoveryCache._get_key(kind, version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._clock() - entry.timestamp > self._ttl:
+                del self._entries[key]
+                return None
+            return entry
+
+    def put(self, kind, version, group, sender, data):
+        key = DiscoveryCache._get_key(kind, version)
+        entry = CacheEntry(tuple(group), tuple(sender), bytes(data), self._clock())
+        with self._lock:
+            self._entries[key] = entry
+            if self._path is not None:
+                self._save()
+
+    def invalidate(self, kind, version):
+        key = DiscoveryCache._get_key(kind, version)
+        with self._lock:
+            if self._entries.pop(key, None) and (self._path is not None):
+                self._save()
+
+    def restore(self, kind, version, decoder):
+        """
+        Decode the cached reply for kind and version with decoder. Return
+        False if there is nothing cached.
+        """
+        entry = self.get(kind, version)
+        if entry is None:
+            return False
+        decoder.reset()
+        decoder.decode(entry.sender, entry.data)
+        return decoder.success
+
+    def _load(self):
+        try:
+            with open(self._path) as cache_file:
+                content = json.load(cache_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as ex:
+            LOGGER.warning("Could not read cache %s: %s", self._path, ex)
+            return
+        for key, value in content.items():
+            try:
+                self._entries[key] = CacheEntry(
+                    tuple(value["group"]),
+                    tuple(value["sender"]),
+                    bytes.fromhex(value["data"]),
+                    value["timestamp"])
+            except (KeyError, TypeError, ValueError) as ex:
+                LOGGER.warning("Ignored cache entry %s: %s", key, ex)
+
+    def _save(self):
+        content = {
+            key: {
+                "group": entry.group,
+                "sender": entry.sender,
+                "data": entry.data.hex(),
+                "timestamp": entry.timestamp}
+            for key, entry in self._entries.items()}
+        temporary_path = self._path + ".tmp"
+        try:
+            with open(temporary_path, "w") as cache_file:
+                json.dump(content, cache_file)
+            os.replace(temporary_path, self._path)
+        except OSError as ex:
+            LOGGER.warning("Could not write cache %s: %s", self._path, ex)
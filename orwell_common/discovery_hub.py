@@ -0,0 +1,324 @@
+import copy
+import logging
+import select
+import socket
+import struct
+import threading
+import time
+
+import orwell_common.broadcast as broadcast
+from orwell_common import codec
+from orwell_common import interfaces
+from orwell_common.broadcast_pinger import EventType
+from orwell_common.broadcast_pinger import PingerEvent
+from orwell_common.broadcast_pinger import get_payload
+
+LOGGER = logging.getLogger(__name__.replace("orwell_common", "orwell.common"))
+
+
+class Subscription(object):
+    """
+    A kind of server followed by a DiscoveryHub, and what the rounds of
+    probes of the hub found about it.
+    """
+
+    def __init__(self, decoder, port, callback):
+        self._decoder = decoder
+        self._port = port
+        self._callback = callback
+        self._message = codec.encode_request(decoder.version)
+        self._server = None
+        self._sender = None
+        self._payload = None
+        self._answered = False
+
+    @property
+    def decoder(self):
+        return self._decoder
+
+    @property
+    def port(self):
+        return self._port
+
+    @property
+    def message(self):
+        return self._message
+
+    @property
+    def callback(self):
+        return self._callback
+
+    @property
+    def server(self):
+        """
+        (ip, port) of the server found or None.
+        """
+        return self._server
+
+    @property
+    def found(self):
+        return self._server is not None
+
+    @property
+    def payload(self):
+        """
+        What was last reported about the server (see PingerEvent).
+        """
+        return self._payload
+
+    @property
+    def answered(self):
+        """
+        True if a reply was given to the subscription in the current round.
+        """
+        return self._answered
+
+    def start_round(self):
+        self._answered = False
+
+    def answer(self, decoder, sender):
+        """
+        Give the subscription the reply from sender decoded by decoder (a copy
+        of its own decoder).
+        """
+        self._decoder = decoder
+        self._sender = sender
+        self._answered = True
+
+    def end_round(self):
+        """
+        Update the server from the reply of the round (if any) and return the
+        EventType to report, None if nothing changed.
+        """
+        event_type = None
+        if self._answered:
+            payload = get_payload(self._decoder)
+            if not self.found:
+                self._server = self._sender
+                event_type = EventType.FOUND
+            elif payload != self._payload:
+                event_type = EventType.CHANGED
+            self._payload = payload
+        elif self.found:
+            self._server = None
+            self._payload = None
+            event_type = EventType.LOST
+        return event_type
+
+
+class DiscoveryHub(threading.Thread):
+    """
+    Look for several kinds of servers and check that they remain available
+    from a single thread. Each subscription has its own decoder (hence
+    version message and kind) and port. Subscriptions sharing the same
+    message and port share probes and replies. Callbacks receive the same
+    PingerEvent as with a BroadcastPinger.
+
+    Rather than a single socket, each distinct message is sent from its own
+    socket: as the servers do not echo the message back, a shared socket
+    cannot tell which probe a reply answers when the replies of different
+    messages look alike (like the ProxyRobots robot and admin ports). A
+    reply is therefore routed by the socket it arrives on and the port it
+    comes from. This costs one socket per distinct message (a few, as
+    there is one message per version) instead of one for the whole hub,
+    all of them waited for with a single select.
+    """
+
+    def __init__(self, sleep_duration=4, timeout=3, inventory=None):
+        """
+        sleep_duration: delay in seconds between two rounds of probes.
+        timeout: time in seconds to wait for the replies of a round.
+        inventory: InterfaceInventory giving the broadcast addresses.
+        """
+        threading.Thread.__init__(self)
+        self._sleep_duration = sleep_duration
+        self._timeout = timeout
+        if inventory is None:
+            inventory = interfaces.get_default_inventory()
+        self._inventory = inventory
+        self._size = 512
+        # message -> socket sending it
+        self._sockets = {}
+        self._subscriptions = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def subscribe(self, decoder, callback, port=broadcast.DEFAULT_PORT):
+        """
+        Follow the servers decoder understands on port and call
+        callback(event) from the hub thread with each PingerEvent.
+        """
+        subscription = Subscription(decoder, port, callback)
+        with self._lock:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.remove(subscription)
+
+    def stop(self):
+        """
+        Make run return as soon as possible (from any thread).
+        """
+        self._stop_event.set()
+        with self._lock:
+            sockets = list(self._sockets.values())
+        if not sockets:
+            return
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as waker:
+                for sock in sockets:
+                    _, port = sock.getsockname()
+                    if port:
+                        waker.sendto(b"", ("127.0.0.1", port))
+        except OSError as ex:
+            LOGGER.debug("could not wake up socket: %s", ex)
+
+    def _get_socket(self, message):
+        with self._lock:
+            sock = self._sockets.get(message)
+            if sock is None:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                ttl = struct.pack('b', 1)
+                sock.setsockopt(
+                    socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+                self._sockets[message] = sock
+            return sock
+
+    def _close_sockets(self):
+        with self._lock:
+            sockets = list(self._sockets.values())
+            self._sockets = {}
+        for sock in sockets:
+            sock.close()
+
+    def run(self, max_loops=0):
+        """
+        max_loops: if greater than zero maximum number of rounds performed
+        before exiting, otherwise ignored.
+        """
+        loops = 0
+        try:
+            while (max_loops <= 0) or (loops < max_loops):
+                if self._stop_event.is_set():
+                    break
+                if max_loops > 0:
+                    loops += 1
+                with self._lock:
+                    subscriptions = list(self._subscriptions)
+                self._run_round(subscriptions)
+                if self._stop_event.is_set():
+                    break
+                for subscription in subscriptions:
+                    self._update(subscription)
+                self._stop_event.wait(self._sleep_duration)
+        finally:
+            self._close_sockets()
+            with self._lock:
+                subscriptions = list(self._subscriptions)
+            for subscription in subscriptions:
+                self._notify(subscription, EventType.STOPPED, None)
+
+    def _run_round(self, subscriptions):
+        """
+        Send the probes of all the subscriptions and route the replies until
+        all have answered or the timeout expires.
+        """
+        for subscription in subscriptions:
+            subscription.start_round()
+        for subscription in subscriptions:
+            self._get_socket(subscription.message)
+        with self._lock:
+            # socket -> message it sends
+            messages = {sock: message for message, sock in self._sockets.items()}
+        for sock in messages:
+            self._drain_stale_replies(sock)
+        broadcast_ips = self._inventory.broadcast_addresses()
+        probes = set()
+        for subscription in subscriptions:
+            if subscription.found:
+                server_ip, _ = subscription.server
+                targets = [server_ip]
+            else:
+                targets = broadcast_ips
+            for ip in targets:
+                probes.add((subscription.message, (ip, subscription.port)))
+        for message, group in probes:
+            try:
+                self._get_socket(message).sendto(message, group)
+            except OSError as ex:
+                LOGGER.warning("Could not send to %s: %s", group, ex)
+        deadline = time.monotonic() + self._timeout
+        while not all(subscription.answered for subscription in subscriptions):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select(list(messages), (), (), remaining)
+            if self._stop_event.is_set():
+                break
+            for sock in readable:
+                try:
+                    data, sender = sock.recvfrom(self._size)
+                except BlockingIOError:
+                    continue
+                self._route(subscriptions, messages[sock], data, sender)
+
+    def _drain_stale_replies(self, sock):
+        # the sockets stay non-blocking, select does the waiting
+        sock.setblocking(False)
+        try:
+            while True:
+                try:
+                    sock.recvfrom(self._size)
+                except BlockingIOError:
+                    break
+        except OSError:
+            # not bound yet, nothing to drain
+            pass
+
+    def _route(self, subscriptions, message, data, sender):
+        """
+        Give the reply to message to the first subscription sending message
+        on the port of sender whose decoder accepts it (the one that already
+        found sender first), and to the others with the same probe.
+        """
+        sender_ip, sender_port = sender
+        candidates = [
+            subscription for subscription in subscriptions
+            if (subscription.port == sender_port) and
+            (subscription.message == message) and
+            not subscription.answered]
+        candidates.sort(key=lambda subscription: subscription.server != sender)
+        for subscription in candidates:
+            decoder = copy.copy(subscription.decoder)
+            decoder.reset()
+            try:
+                decoder.decode(sender, data)
+            except broadcast.DecodeError:
+                continue
+            if decoder.success:
+                break
+        else:
+            return
+        for candidate in candidates:
+            if type(candidate.decoder) is type(decoder):
+                candidate.answer(copy.copy(decoder), sender)
+
+    def _update(self, subscription):
+        event_type = subscription.end_round()
+        if event_type is None:
+            return
+        if EventType.FOUND == event_type:
+            LOGGER.info("Made contact with %s.", subscription.decoder.kind.value)
+        elif EventType.LOST == event_type:
+            LOGGER.info("Contact lost with %s.", subscription.decoder.kind.value)
+        self._notify(subscription, event_type, subscription.payload)
+
+    def _notify(self, subscription, event_type, payload):
+        event = PingerEvent(event_type, subscription.decoder.kind, payload)
+        try:
+            subscription.callback(event)
+        except Exception:
+            LOGGER.exception("Callback failed for %s", event)
@@ -0,0 +1,328 @@
+import collections
+import errno
+import fnmatch
+import ipaddress
+import logging
+import socket
+import struct
+import threading
+import time
+import weakref
+
+LOGGER = logging.getLogger(__name__.replace("orwell_common", "orwell.common"))
+
+# multicast groups of rtnetlink (see linux/rtnetlink.h)
+_RTMGRP_LINK = 0x1
+_RTMGRP_IPV4_IFADDR = 0x10
+
+Interface = collections.namedtuple(
+    "Interface", ("name", "address", "netmask", "broadcast"))
+
+
+def scan_interfaces():
+    """
+    Return the IPv4 addresses of the interfaces that have a broadcast
+    address, in the order given by netifaces.
+    """
+    # netifaces is only loaded once interfaces are actually needed
+    import netifaces
+    results = []
+    for interface in netifaces.interfaces():
+        addresses = netifaces.ifaddresses(interface)
+        if netifaces.AF_INET not in addresses:
+            continue
+        ipv4_addresses = addresses[netifaces.AF_INET]
+        if not ipv4_addresses:
+            continue
+        for ipv4_address in ipv4_addresses:
+            if "broadcast" not in ipv4_address:
+                continue
+            results.append(Interface(
+                interface,
+                ipv4_address.get("addr"),
+                ipv4_address.get("netmask"),
+                ipv4_address["broadcast"]))
+    return results
+
+
+def _interface_names():
+    import netifaces
+    return netifaces.interfaces()
+
+
+class InterfaceInventory(object):
+    """
+    Cache of scan_interfaces refreshed only when the interfaces change. On
+    Linux a rtnetlink socket reports link and address changes, elsewhere the
+    names of the interfaces are compared at each check and everything is
+    scanned again at least every ttl seconds.
+    Subscribers are called with (interfaces, added) whenever a refresh finds
+    a different list, added being the new entries.
+    """
+
+    def __init__(self, ttl=30, use_netlink=True, clock=time.monotonic):
+        self._ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._interfaces = None
+        self._names = None
+        self._refresh_time = None
+        self._subscribers = []
+        self._netlink = InterfaceInventory._open_netlink() if use_netlink else None
+
+    @staticmethod
+    def _open_netlink():
+        if not hasattr(socket, "AF_NETLINK"):
+            return None
+        try:
+            sock = socket.socket(
+                socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            sock.bind((0, _RTMGRP_LINK | _RTMGRP_IPV4_IFADDR))
+            sock.setblocking(False)
+        except OSError as ex:
+            LOGGER.debug("netlink not available: %s", ex)
+            return None
+        return sock
+
+    def close(self):
+        if self._netlink is not None:
+            self._netlink.close()
+            self._netlink = None
+
+    def subscribe(self, callback):
+        """
+        Call callback(interfaces, added) when the interfaces change. Bound
+        methods are only weakly referenced.
+        """
+        if hasattr(callback, "__self__"):
+            reference = weakref.WeakMethod(callback)
+        else:
+            reference = lambda: callback
+        with self._lock:
+            self._subscribers = [
+                previous for previous in self._subscribers
+                if previous() is not None]
+            self._subscribers.append(reference)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = [
+                reference for reference in self._subscribers
+                if reference() not in (None, callback)]
+
+    def interfaces(self):
+        """
+        Return the (cached) list of Interface.
+        """
+        with self._lock:
+            if not self._has_changed():
+                return list(self._interfaces)
+            previous = self._interfaces
+            self._interfaces = scan_interfaces()
+            self._names = _interface_names()
+            self._refresh_time = self._clock()
+            interfaces = list(self._interfaces)
+            subscribers = [reference() for reference in self._subscribers]
+        if (previous is not None) and (previous != interfaces):
+            added = [entry for entry in interfaces if entry not in previous]
+            LOGGER.info("interfaces changed, added: %s", added)
+            for subscriber in subscribers:
+                if subscriber is not None:
+                    subscriber(interfaces, added)
+        return interfaces
+
+    def broadcast_addresses(self):
+        return [entry.broadcast for entry in self.interfaces()]
+
+    def _has_changed(self):
+        if self._interfaces is None:
+            return True
+        if self._netlink is not None:
+            return self._drain_netlink()
+        if self._clock() - self._refresh_time > self._ttl:
+            return True
+        return _interface_names() != self._names
+
+    def _drain_netlink(self):
+        changed = False
+        while True:
+            try:
+                self._netlink.recv(65536)
+            except BlockingIOError:
+                break
+            except OSError as ex:
+                if ex.errno != errno.ENOBUFS:
+                    raise
+                # some notifications were lost, refresh anyway
+            changed = True
+        return changed
+
+
+class StaticInventory(InterfaceInventory):
+    """
+    Fixed list of interfaces, for tests and benchmarks.
+    """
+
+    def __init__(self, interfaces):
+        InterfaceInventory.__init__(self, use_netlink=False)
+        self._interfaces = list(interfaces)
+
+    def set_interfaces(self, interfaces):
+        """
+        Replace the interfaces and notify the subscribers.
+        """
+        previous = self._interfaces
+        with self._lock:
+            self._interfaces = list(interfaces)
+            subscribers = [reference() for reference in self._subscribers]
+        added = [entry for entry in interfaces if entry not in previous]
+        for subscriber in subscribers:
+            if subscriber is not None:
+                subscriber(list(interfaces), added)
+
+    def _has_changed(self):
+        return False
+
+
+_DEFAULT_INVENTORY = None
+_DEFAULT_INVENTORY_LOCK = threading.Lock()
+
+
+def get_default_inventory():
+    """
+    Return the InterfaceInventory shared by default by the whole process.
+    """
+    global _DEFAULT_INVENTORY
+    with _DEFAULT_INVENTORY_LOCK:
+        if _DEFAULT_INVENTORY is None:
+            _DEFAULT_INVENTORY = InterfaceInventory()
+        return _DEFAULT_INVENTORY
+
+
+def find_interface(interfaces, ip):
+    """
+    Return the Interface of interfaces whose network contains ip (or whose
+    broadcast address is ip), None if there is none.
+    """
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    for entry in interfaces:
+        if entry.broadcast == ip:
+            return entry
+        if (entry.address is None) or (entry.netmask is None):
+            continue
+        network = ipaddress.ip_network(
+            "%s/%s" % (entry.address, entry.netmask), strict=False)
+        if address in network:
+            return entry
+    return None
+
+
+def join_multicast_group(sock, group, interfaces):
+    """
+    Make sock receive the datagrams sent to the multicast group on each of
+    interfaces (on the default one if interfaces is empty). Return the
+    addresses of the interfaces that joined.
+    """
+    addresses = [entry.address for entry in interfaces] or ["0.0.0.0"]
+    joined = []
+    for address in addresses:
+        membership = struct.pack(
+            "4s4s", socket.inet_aton(group), socket.inet_aton(address))
+        try:
+            sock.setsockopt(
+                socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        except OSError as ex:
+            LOGGER.warning(
+                "Could not join %s on %s: %s", group, address, ex)
+        else:
+            joined.append(address)
+    LOGGER.debug("joined %s on %s", group, joined)
+    return joined
+
+
+# names of virtual interfaces that are seldom worth probing
+VIRTUAL_INTERFACES = ("docker*", "br-*", "veth*", "virbr*", "tun*", "tap*")
+
+
+class InterfacePolicy(object):
+    """
+    Choose which interfaces to probe and in which order. An interface is
+    dropped if its name matches one of the exclude globs, if include is given
+    and its name matches none of the include globs, or if networks is given
+    and its address is outside of all of them. The others are sorted by past
+    success rate and then by smoothed round-trip time, best first.
+    """
+
+    def __init__(
+            self,
+            include=None,
+            exclude=(),
+            networks=None,
+            rtt_smoothing=0.25):
+        """
+        include: globs of interface names to keep (None to keep all).
+        exclude: globs of interface names to drop (see VIRTUAL_INTERFACES).
+        networks: CIDR allowed for the interface addresses (None to allow all).
+        rtt_smoothing: weight of a new round-trip time in the average.
+        """
+        self._include = include
+        self._exclude = exclude
+        if networks is None:
+            self._networks = None
+        else:
+            self._networks = [
+                ipaddress.ip_network(network, strict=False)
+                for network in networks]
+        self._rtt_smoothing = rtt_smoothing
+        self._lock = threading.Lock()
+        # broadcast address -> [successes, failures, smoothed rtt]
+        self._statistics = {}
+
+    def accepts(self, interface):
+        name = interface.name
+        if any(fnmatch.fnmatchcase(name, glob) for glob in self._exclude):
+            return False
+        if (self._include is not None) and not any(
+                fnmatch.fnmatchcase(name, glob) for glob in self._include):
+            return False
+        if self._networks is not None:
+            try:
+                address = ipaddress.ip_address(interface.address)
+            except ValueError:
+                return False
+            if not any(address in network for network in self._networks):
+                return False
+        return True
+
+    def order(self, interfaces):
+        """
+        Return the accepted interfaces, most likely to answer first.
+        """
+        accepted = [entry for entry in interfaces if self.accepts(entry)]
+        with self._lock:
+            return sorted(accepted, key=self._rank)
+
+    def _rank(self, interface):
+        successes, failures, rtt = self._statistics.get(
+            interface.broadcast, (0, 0, None))
+        # Laplace smoothing so that unknown interfaces rank in the middle
+        success_rate = (successes + 1) / (successes + failures + 2)
+        return (-success_rate, float("inf") if rtt is None else rtt)
+
+    def record_success(self, broadcast, rtt=None):
+        with self._lock:
+            statistics = self._statistics.setdefault(broadcast, [0, 0, None])
+            statistics[0] += 1
+            if rtt is not None:
+                if statistics[2] is None:
+                    statistics[2] = rtt
+                else:
+                    statistics[2] += self._rtt_smoothing * (rtt - statistics[2])
+
+    def record_failure(self, broadcast):
+        with self._lock:
+            statistics = self._statistics.setdefault(broadcast, [0, 0, None])
+            statistics[1] += 1
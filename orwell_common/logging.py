@@ -1,16 +1,101 @@
+import atexit
 import logging
+import logging.handlers
+import queue
+import threading
 
+from orwell_common.throttle import RateLimiter
 
-def configure_logging(verbose):
-    print("configure_logging")
+_LOCK = threading.Lock()
+_HANDLER = None
+_LISTENER = None
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Drop the records logged too often from the same place (same logger and
+    same message before formatting), like the ones logged for each packet.
+    Records above max_level always pass.
+    """
+
+    def __init__(self, rate=10, burst=20, max_level=logging.INFO):
+        """
+        rate: records per second allowed for each message.
+        burst: records of a message allowed at once.
+        """
+        logging.Filter.__init__(self)
+        self._limiter = RateLimiter(rate, burst)
+        self._max_level = max_level
+
+    @property
+    def dropped(self):
+        """
+        Number of records dropped so far.
+        """
+        return self._limiter.rejected
+
+    def filter(self, record):
+        if record.levelno > self._max_level:
+            return True
+        return self._limiter.allow((record.name, record.msg))
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue the records as they are: the queue never leaves the process so
+    the messages are only formatted by the writer thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def configure_logging(verbose, rate_limit=None):
+    """
+    Send the records of the "orwell" loggers to stderr from a background
+    thread so that logging costs the caller little more than a queue put.
+    Calling it again only changes the settings.
+
+    verbose: log debug messages too.
+    rate_limit: if not None maximum number per second of records logged
+    from the same place (see RateLimitFilter), warnings and errors excepted.
+    """
+    global _HANDLER, _LISTENER
     logger = logging.getLogger("orwell")
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter(
-        '%(asctime)s %(name)-12s %(levelname)-8s '
-        '%(filename)s %(lineno)d %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    with _LOCK:
+        if _HANDLER is None:
+            print("configure_logging")
+            handler = logging.StreamHandler()
+            formatter = logging.Formatter(
+                '%(asctime)s %(name)-12s %(levelname)-8s '
+                '%(filename)s %(lineno)d %(message)s')
+            handler.setFormatter(formatter)
+            records = queue.SimpleQueue()
+            _HANDLER = _QueueHandler(records)
+            _LISTENER = logging.handlers.QueueListener(records, handler)
+            _LISTENER.start()
+            logger.addHandler(_HANDLER)
+            atexit.register(shutdown_logging)
+        for previous in list(_HANDLER.filters):
+            _HANDLER.removeFilter(previous)
+        if rate_limit is not None:
+            _HANDLER.addFilter(RateLimitFilter(rate_limit, 2 * rate_limit))
     if verbose:
         logger.setLevel(logging.DEBUG)
     else:
         logger.setLevel(logging.INFO)
+
+
+def shutdown_logging():
+    """
+    Write the records still queued and stop the background thread (called
+    at exit).
+    """
+    global _HANDLER, _LISTENER
+    with _LOCK:
+        if _HANDLER is None:
+            return
+        logging.getLogger("orwell").removeHandler(_HANDLER)
+        _LISTENER.stop()
+        _HANDLER = None
+        _LISTENER = None
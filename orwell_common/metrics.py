@@ -0,0 +1,138 @@
+import bisect
+import threading
+
+# upper bounds in seconds of the buckets of the histograms
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+PROBES_SENT = "probes_sent"
+REPLIES_RECEIVED = "replies_received"
+TIMEOUTS = "timeouts"
+DECODE_FAILURES = "decode_failures"
+RTT_SECONDS = "rtt_seconds"
+DISCOVERY_SECONDS = "discovery_seconds"
+
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self._buckets = buckets
+        # the last count is for the values above the last bucket
+        self._counts = [0] * (len(buckets) + 1)
+        self._count = 0
+        self._sum = 0
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self._buckets, value)] += 1
+        self._count += 1
+        self._sum += value
+
+    def snapshot(self):
+        cumulative = 0
+        buckets = []
+        for upper_bound, count in zip(self._buckets, self._counts):
+            cumulative += count
+            buckets.append((upper_bound, cumulative))
+        return {"count": self._count, "sum": self._sum, "buckets": buckets}
+
+
+class Metrics(object):
+    """
+    In-process counters and histograms of the discovery, labelled by
+    interface and by Kind (either can be None).
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def increment(self, name, interface=None, kind=None, value=1):
+        key = (name, interface, kind)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, interface=None, kind=None):
+        key = (name, interface, kind)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = Histogram(self._buckets)
+                self._histograms[key] = histogram
+            histogram.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        """
+        Return a copy of the metrics made of plain lists and dictionaries.
+        """
+        with self._lock:
+            counters = [
+                {"name": name, "interface": interface, "kind": kind,
+                 "value": value}
+                for (name, interface, kind), value in self._counters.items()]
+            histograms = []
+            for (name, interface, kind), histogram in self._histograms.items():
+                entry = {"name": name, "interface": interface, "kind": kind}
+                entry.update(histogram.snapshot())
+                histograms.append(entry)
+        return {"counters": counters, "histograms": histograms}
+
+    def to_prometheus(self, prefix="orwell_"):
+        """
+        Return the metrics in the Prometheus text exposition format, each
+        family preceded by its TYPE.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        family = None
+        # sorted by name so that the samples of a family are contiguous
+        for counter in sorted(snapshot["counters"], key=_sort_key):
+            name = prefix + counter["name"] + "_total"
+            if name != family:
+                family = name
+                lines.append("# TYPE %s counter" % name)
+            lines.append("%s%s %s" % (
+                name, _format_labels(counter), counter["value"]))
+        for histogram in sorted(snapshot["histograms"], key=_sort_key):
+            name = prefix + histogram["name"]
+            if name != family:
+                family = name
+                lines.append("# TYPE %s histogram" % name)
+            for upper_bound, count in histogram["buckets"]:
+                lines.append("%s_bucket%s %s" % (
+                    name,
+                    _format_labels(histogram, le=repr(float(upper_bound))),
+                    count))
+            lines.append("%s_bucket%s %s" % (
+                name, _format_labels(histogram, le="+Inf"), histogram["count"]))
+            lines.append("%s_sum%s %s" % (
+                name, _format_labels(histogram), histogram["sum"]))
+            lines.append("%s_count%s %s" % (
+                name, _format_labels(histogram), histogram["count"]))
+        return "\n".join(lines) + "\n"
+
+
+def _sort_key(entry):
+    return (entry["name"], entry["interface"] or "", entry["kind"] or "")
+
+
+def _format_labels(entry, **extra):
+    labels = []
+    for label in ("interface", "kind"):
+        if entry[label] is not None:
+            labels.append((label, entry[label]))
+    labels.extend(extra.items())
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (label, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for label, value in labels)
+
+
+# registry used by default by the discovery classes
+METRICS = Metrics()
@@ -0,0 +1,115 @@
+import collections
+import logging
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__.replace("orwell_common", "orwell.common"))
+
+
+class PortPool(object):
+    """
+    Ports handed out to robots. Each robot (identified by a key, usually its
+    ip) holds a lease on its port: asking again returns the same port and
+    renews the lease, and a lease that is not renewed within ttl seconds
+    expires so that its port can be given to another robot.
+    """
+
+    def __init__(
+            self,
+            ports=(),
+            ttl=None,
+            sockets_lister=None,
+            clock=time.monotonic):
+        """
+        ports: ports available at first.
+        ttl: duration of a lease in seconds, None for leases that never expire.
+        sockets_lister: if not None the free ports are the ones of the
+        available sockets of this SocketsLister and released ports give their
+        socket back to it.
+        clock: function returning the current time in seconds.
+        """
+        self._free_ports = collections.deque(ports)
+        # leases are kept in expiry order as they all last ttl
+        self._leases = collections.OrderedDict()
+        self._ttl = ttl
+        self._sockets_lister = sockets_lister
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def add_port(self, port):
+        with self._lock:
+            self._free_ports.append(port)
+
+    def allocate(self, key=None):
+        """
+        Return the port leased to key (a new one if needed) or None if no
+        port is available. If key is None the port is handed out without a
+        lease and never comes back.
+        """
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            lease = self._leases.pop(key, None) if key is not None else None
+            if lease is not None:
+                port, _ = lease
+            else:
+                port = self._take_port()
+                if port is None:
+                    return None
+                if key is None:
+                    return port
+                LOGGER.debug("port %s leased to %s", port, key)
+            expiry = None if self._ttl is None else now + self._ttl
+            self._leases[key] = (port, expiry)
+            return port
+
+    def release(self, key):
+        """
+        End the lease of key (if any) and make its port available again.
+        """
+        with self._lock:
+            lease = self._leases.pop(key, None)
+            if lease is not None:
+                port, _ = lease
+                self._give_back(port)
+
+    def expire(self):
+        """
+        Make the ports of the expired leases available again.
+        """
+        with self._lock:
+            self._expire(self._clock())
+
+    def _expire(self, now):
+        while self._leases:
+            key, (port, expiry) = next(iter(self._leases.items()))
+            if (expiry is None) or (expiry > now):
+                break
+            del self._leases[key]
+            LOGGER.debug("lease of port %s by %s expired", port, key)
+            self._give_back(port)
+
+    def _take_port(self):
+        if self._sockets_lister is not None:
+            sock = self._sockets_lister.pop_available_socket()
+            if sock is None:
+                return None
+            _, port = sock.getsockname()
+            return port
+        if self._free_ports:
+            return self._free_ports.popleft()
+        return None
+
+    def _give_back(self, port):
+        if self._sockets_lister is not None:
+            self._sockets_lister.release_port(port)
+        else:
+            self._free_ports.append(port)
+
+    @property
+    def leases(self):
+        """
+        Copy of the current leases as a dictionary key -> port.
+        """
+        with self._lock:
+            return {key: port for key, (port, _) in self._leases.items()}
@@ -0,0 +1,128 @@
+import random
+
+
+class AdaptiveScheduler(object):
+    """
+    Timeout and delay between the probes of a BroadcastPinger.
+
+    The timeout follows the measured round-trip time like TCP does for its
+    retransmission timeout (RFC 6298): a smoothed round-trip time (SRTT) and
+    its variation (RTTVAR) give timeout = SRTT + 4 * RTTVAR, and the timeout
+    doubles each time a probe goes unanswered.
+
+    While in contact probes are sent every heartbeat_interval so that a lost
+    server is noticed quickly, but it is only considered lost after
+    lost_after probes unanswered in a row: with a timeout that can go down
+    to min_timeout on a LAN a single dropped packet must not be enough.
+    While the server cannot be reached the delay
+    doubles after each failure up to max_interval, with some random jitter so
+    that many clients do not probe in step.
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    def __init__(
+            self,
+            initial_timeout=3,
+            min_timeout=0.05,
+            max_timeout=3,
+            heartbeat_interval=0.5,
+            initial_interval=1,
+            max_interval=30,
+            jitter=0.5,
+            lost_after=3,
+            random=random.random):
+        """
+        initial_timeout: timeout in seconds before any round-trip time is
+        known.
+        min_timeout, max_timeout: bounds of the timeout in seconds.
+        heartbeat_interval: delay in seconds between probes while in contact.
+        initial_interval: delay in seconds after the first failure.
+        max_interval: maximum delay in seconds while the server is unreachable.
+        jitter: fraction of the delay that is randomly removed (0 for none).
+        lost_after: number of probes unanswered in a row after which a server
+        in contact is considered lost.
+        random: function returning a number in [0, 1).
+        """
+        self._initial_timeout = initial_timeout
+        self._min_timeout = min_timeout
+        self._max_timeout = max_timeout
+        self._heartbeat_interval = heartbeat_interval
+        self._initial_interval = initial_interval
+        self._max_interval = max_interval
+        self._jitter = jitter
+        self._lost_after = lost_after
+        self._random = random
+        self._srtt = None
+        self._rttvar = None
+        self._timeout = initial_timeout
+        self._failures = 0
+
+    @property
+    def timeout(self):
+        """
+        Time in seconds to wait for the reply to the next probe.
+        """
+        return self._timeout
+
+    @property
+    def srtt(self):
+        return self._srtt
+
+    @property
+    def failures(self):
+        """
+        Number of probes unanswered in a row.
+        """
+        return self._failures
+
+    @property
+    def lost(self):
+        """
+        True if enough probes went unanswered in a row to give up on the
+        server.
+        """
+        return self._failures >= self._lost_after
+
+    def on_success(self, rtt):
+        """
+        A probe was answered after rtt seconds (None if unknown).
+        """
+        self._failures = 0
+        if rtt is None:
+            return
+        if self._srtt is None:
+            self._srtt = rtt
+            self._rttvar = rtt / 2
+        else:
+            self._rttvar = (
+                (1 - AdaptiveScheduler.BETA) * self._rttvar +
+                AdaptiveScheduler.BETA * abs(self._srtt - rtt))
+            self._srtt = (
+                (1 - AdaptiveScheduler.ALPHA) * self._srtt +
+                AdaptiveScheduler.ALPHA * rtt)
+        self._timeout = self._clamp(
+            self._srtt + AdaptiveScheduler.K * self._rttvar)
+
+    def on_failure(self):
+        """
+        A probe was not answered in time.
+        """
+        self._failures += 1
+        self._timeout = self._clamp(self._timeout * 2)
+
+    def next_interval(self):
+        """
+        Return the time in seconds to wait before the next probe.
+        """
+        if not self._failures:
+            return self._heartbeat_interval
+        interval = min(
+            self._max_interval,
+            self._initial_interval * 2 ** (self._failures - 1))
+        return interval * (1 - self._jitter * self._random())
+
+    def _clamp(self, timeout):
+        return min(self._max_timeout, max(self._min_timeout, timeout))
@@ -0,0 +1,396 @@
+"""
+In-memory datagram network with a virtual clock to run the discovery
+deterministically and much faster than real time.
+
+A Fabric is made of simulated interfaces (subnets with their own loss,
+delay and reordering) and hosts attached to them. Each VirtualHost is a
+transport (like transport.SYSTEM) that can be given to Broadcast,
+BroadcastPinger or BroadcastListener:
+
+    fabric = Fabric(seed=1)
+    fabric.add_interface("lan", "10.0.0.0/24", loss=0.1, delay=0.002)
+    server = fabric.add_host("server", "lan")
+    listener = BroadcastListener(9080, transport=server)
+    fabric.serve(listener)
+    client = fabric.add_host("robot", "lan")
+    pinger = BroadcastPinger(
+        None, decoder=ProxyRobotsDecoder(), transport=client,
+        inventory=client.inventory())
+    pinger.run(max_loops=100)
+
+Everything runs in the calling thread: a socket waiting for a datagram
+advances the virtual clock to the next scheduled delivery (or to its
+timeout) instead of blocking. Listeners given to Fabric.serve handle each
+datagram as soon as it is delivered. AsyncBroadcast and the selector based
+listeners need real sockets and cannot run on a Fabric.
+"""
+import collections
+import heapq
+import ipaddress
+import itertools
+import random
+import socket
+
+from orwell_common.interfaces import Interface
+from orwell_common.interfaces import StaticInventory
+
+
+class VirtualClock(object):
+    def __init__(self, start=0.0):
+        self._now = start
+
+    def monotonic(self):
+        return self._now
+
+    def time(self):
+        return self._now
+
+    def _set(self, now):
+        self._now = now
+
+
+class VirtualInterface(object):
+    """
+    A simulated subnet.
+    """
+
+    def __init__(self, name, network, loss, delay, jitter, reorder):
+        self._name = name
+        self._network = ipaddress.ip_network(network)
+        self._hosts = self._network.hosts()
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.reorder = reorder
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def network(self):
+        return self._network
+
+    @property
+    def broadcast(self):
+        return str(self._network.broadcast_address)
+
+    def _allocate_address(self):
+        return str(next(self._hosts))
+
+
+class VirtualSocket(object):
+    """
+    Subset of socket.socket used by the discovery classes.
+    """
+
+    def __init__(self, host):
+        self._host = host
+        self._port = None
+        self._timeout = None
+        self._datagrams = collections.deque()
+        self._closed = False
+        self.on_readable = None
+
+    def setsockopt(self, *args):
+        pass
+
+    def settimeout(self, timeout):
+        self._timeout = timeout
+
+    def gettimeout(self):
+        return self._timeout
+
+    def setblocking(self, blocking):
+        self._timeout = None if blocking else 0.0
+
+    def bind(self, address):
+        _, port = address
+        self._host._bind(self, port)
+
+    def getsockname(self):
+        return ("0.0.0.0", self._port or 0)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._host._unbind(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def sendto(self, data, address):
+        if self._closed:
+            raise OSError("socket closed")
+        if self._port is None:
+            self._host._bind(self, 0)
+        self._host._send(self, bytes(data), address)
+        return len(data)
+
+    def recvfrom(self, size):
+        fabric = self._host.fabric
+        if self._timeout is None:
+            deadline = None
+        else:
+            deadline = fabric.clock.monotonic() + self._timeout
+        while not self._datagrams:
+            if self._closed:
+                raise OSError("socket closed")
+            if 0.0 == self._timeout:
+                raise BlockingIOError("no datagram available")
+            if not fabric._run_next_event(deadline):
+                if deadline is None:
+                    raise RuntimeError(
+                        "recvfrom would block forever: nothing scheduled")
+                raise socket.timeout("timed out")
+        data, sender = self._datagrams.popleft()
+        return data[:size], sender
+
+    def _deliver(self, data, sender):
+        if self._closed:
+            return
+        self._datagrams.append((data, sender))
+        if self.on_readable is not None:
+            self.on_readable()
+
+
+class VirtualHost(object):
+    """
+    A machine attached to some interfaces of a Fabric. It is a transport:
+    its sockets send through the Fabric and its time is the virtual one.
+    """
+
+    def __init__(self, fabric, name):
+        self._fabric = fabric
+        self._name = name
+        # interface name -> address of the host on it
+        self._addresses = collections.OrderedDict()
+        self._sockets = {}
+        self._ephemeral_ports = itertools.count(49152)
+
+    @property
+    def fabric(self):
+        return self._fabric
+
+    @property
+    def name(self):
+        return self._name
+
+    def address(self, interface_name):
+        return self._addresses[interface_name]
+
+    def inventory(self):
+        """
+        Return a StaticInventory of the interfaces of the host.
+        """
+        entries = []
+        for interface_name, address in self._addresses.items():
+            interface = self._fabric.interface(interface_name)
+            entries.append(Interface(
+                interface_name,
+                address,
+                str(interface.network.netmask),
+                interface.broadcast))
+        return StaticInventory(entries)
+
+    # transport interface
+
+    def socket(self, family=socket.AF_INET, type=socket.SOCK_DGRAM):
+        return VirtualSocket(self)
+
+    def monotonic(self):
+        return self._fabric.clock.monotonic()
+
+    def time(self):
+        return self._fabric.clock.time()
+
+    def wait(self, event, timeout):
+        if not event.is_set():
+            self._fabric.run(timeout, until=event.is_set)
+        return event.is_set()
+
+    # internals
+
+    def _attach(self, interface, address):
+        self._addresses[interface.name] = address
+
+    def _bind(self, sock, port):
+        if port == 0:
+            port = next(self._ephemeral_ports)
+            while port in self._sockets:
+                port = next(self._ephemeral_ports)
+        elif port in self._sockets:
+            raise OSError("address already in use: %s" % port)
+        sock._port = port
+        self._sockets[port] = sock
+
+    def _unbind(self, sock):
+        if self._sockets.get(sock._port) is sock:
+            del self._sockets[sock._port]
+
+    def _send(self, sock, data, address):
+        ip, port = address
+        route = self._fabric._route(self, ip)
+        if route is None:
+            return
+        interface, recipients = route
+        sender = (self._addresses[interface.name], sock._port)
+        for recipient in recipients:
+            self._fabric._transmit(interface, recipient, data, sender, port)
+
+    def _receive(self, data, sender, port):
+        sock = self._sockets.get(port)
+        if sock is not None:
+            sock._deliver(data, sender)
+
+
+class Fabric(object):
+    """
+    Simulated network and virtual clock (see the module documentation).
+    """
+
+    def __init__(self, seed=None, start=0.0):
+        self._clock = VirtualClock(start)
+        self._random = random.Random(seed)
+        self._interfaces = collections.OrderedDict()
+        self._hosts = collections.OrderedDict()
+        # address -> host
+        self._addresses = {}
+        self._events = []
+        self._sequence = itertools.count()
+        self._sent = 0
+        self._dropped = 0
+
+    @property
+    def clock(self):
+        return self._clock
+
+    @property
+    def sent(self):
+        """
+        Number of datagrams transmitted (one per recipient).
+        """
+        return self._sent
+
+    @property
+    def dropped(self):
+        """
+        Number of datagrams lost on purpose.
+        """
+        return self._dropped
+
+    def add_interface(
+            self,
+            name,
+            network,
+            loss=0.0,
+            delay=0.001,
+            jitter=0.0,
+            reorder=0.0):
+        """
+        network: CIDR of the subnet.
+        loss: probability that a datagram is lost.
+        delay: time in seconds to deliver a datagram.
+        jitter: maximum random time in seconds added to delay.
+        reorder: probability that a datagram is held back long enough for
+        the next ones to overtake it.
+        """
+        interface = VirtualInterface(name, network, loss, delay, jitter, reorder)
+        self._interfaces[name] = interface
+        return interface
+
+    def interface(self, name):
+        return self._interfaces[name]
+
+    def add_host(self, name, *interface_names):
+        """
+        Create a host with an address on each of the given interfaces.
+        """
+        host = VirtualHost(self, name)
+        for interface_name in interface_names:
+            interface = self._interfaces[interface_name]
+            address = interface._allocate_address()
+            host._attach(interface, address)
+            self._addresses[address] = host
+        self._hosts[name] = host
+        return host
+
+    def serve(self, listener):
+        """
+        Make a BroadcastListener created with a VirtualHost as transport
+        answer each datagram as soon as it is delivered.
+        """
+        listener._socket.on_readable = lambda: listener.run(1)
+
+    def call_later(self, delay, callback):
+        """
+        Call callback after delay virtual seconds.
+        """
+        self._schedule(self._clock.monotonic() + delay, callback)
+
+    def run(self, duration, until=None):
+        """
+        Process the events of the next duration virtual seconds, stopping
+        early when until (if given) returns True.
+        """
+        deadline = self._clock.monotonic() + duration
+        while (until is None) or (not until()):
+            if not self._run_next_event(deadline):
+                break
+
+    def _schedule(self, when, callback):
+        heapq.heappush(self._events, (when, next(self._sequence), callback))
+
+    def _run_next_event(self, deadline):
+        """
+        Run the next event due before deadline (None for no limit) and return
+        True, or move the clock to deadline and return False if there is none.
+        """
+        if self._events and ((deadline is None) or (self._events[0][0] <= deadline)):
+            when, _, callback = heapq.heappop(self._events)
+            if when > self._clock.monotonic():
+                self._clock._set(when)
+            callback()
+            return True
+        if deadline is not None and deadline > self._clock.monotonic():
+            self._clock._set(deadline)
+        return False
+
+    def _route(self, source, ip):
+        """
+        Return the interface to use from source to reach ip and the hosts
+        receiving the datagram, or None if ip cannot be reached.
+        """
+        for interface_name in source._addresses:
+            interface = self._interfaces[interface_name]
+            if ip == interface.broadcast:
+                recipients = [
+                    host for host in self._hosts.values()
+                    if (host is not source) and
+                    (interface_name in host._addresses)]
+                return interface, recipients
+            try:
+                in_network = ipaddress.ip_address(ip) in interface.network
+            except ValueError:
+                return None
+            if in_network:
+                host = self._addresses.get(ip)
+                if host is None:
+                    return interface, []
+                return interface, [host]
+        return None
+
+    def _transmit(self, interface, recipient, data, sender, port):
+        self._sent += 1
+        if self._random.random() < interface.loss:
+            self._dropped += 1
+            return
+        delay = interface.delay + self._random.random() * interface.jitter
+        if self._random.random() < interface.reorder:
+            delay += 2 * (interface.delay + interface.jitter)
+        self._schedule(
+            self._clock.monotonic() + delay,
+            lambda: recipient._receive(data, sender, port))
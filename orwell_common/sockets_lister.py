@@ -1,34 +1,121 @@
+import collections
+import selectors
 import socket
+import threading
 
 
 class SocketsLister(object):
     """
-    Class that for now lists available sockets.
+    Pool of non-blocking UDP sockets bound to ports chosen by the system,
+    one per robot. Sockets are taken and given back in constant time, more
+    are bound when the pool is empty (up to max_sockets) and the ones in
+    use can be waited on together with readable.
     """
-    def __init__(self, socket_count=1):
-        self._sockets = []
-        self._used_sockets = set()
+    def __init__(self, socket_count=1, max_sockets=None):
+        """
+        socket_count: number of sockets bound at first.
+        max_sockets: maximum number of sockets (in use or not), None for
+        no limit.
+        """
+        self._sockets = collections.deque()
+        self._used_sockets = {}
+        self._max_sockets = max_sockets
+        self._count = 0
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
         for i in range(socket_count):
-            sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
-            sock.setblocking(False)
-            sock.bind(("", 0))
-            self._sockets.append(sock)
+            self._sockets.append(self._build_socket())
 
     def __del__(self):
         """
         Make sure we close all the sockets.
         """
-        for sock in self._sockets:
-            sock.close()
-        for sock in self._used_sockets:
-            sock.close()
+        if hasattr(self, "_lock"):
+            self.close()
+
+    def close(self):
+        with self._lock:
+            for sock in self._sockets:
+                sock.close()
+            for sock in self._used_sockets.values():
+                sock.close()
+            self._sockets.clear()
+            self._used_sockets.clear()
+            self._count = 0
+            if self._selector is not None:
+                self._selector.close()
+                self._selector = None
+
+    def _build_socket(self):
+        sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sock.bind(("", 0))
+        self._count += 1
+        return sock
+
+    @property
+    def size(self):
+        """
+        Number of sockets in the pool (in use or not).
+        """
+        return self._count
+
+    @property
+    def available(self):
+        return len(self._sockets)
 
     def pop_available_socket(self):
         """
-        Return the first available socket (or None if none is found).
+        Return the first available socket, a new one if there is none and
+        the pool may grow (or None otherwise).
+        """
+        with self._lock:
+            if self._sockets:
+                available_socket = self._sockets.popleft()
+            elif (self._max_sockets is None) or (self._count < self._max_sockets):
+                available_socket = self._build_socket()
+            else:
+                return None
+            _, port = available_socket.getsockname()
+            self._used_sockets[port] = available_socket
+            self._selector.register(available_socket, selectors.EVENT_READ, port)
+            return available_socket
+
+    def get_socket(self, port):
+        """
+        Return the socket in use bound to port (or None).
+        """
+        return self._used_sockets.get(port)
+
+    def release_socket(self, sock):
+        """
+        Make a socket returned by pop_available_socket available again.
+        """
+        _, port = sock.getsockname()
+        self.release_port(port)
+
+    def release_port(self, port):
+        """
+        Make the socket bound to port available again, dropping what the
+        previous user left unread.
+        """
+        with self._lock:
+            sock = self._used_sockets.pop(port, None)
+            if sock is None:
+                return
+            self._selector.unregister(sock)
+            while True:
+                try:
+                    sock.recv(4096)
+                except OSError:
+                    break
+            self._sockets.append(sock)
+
+    def readable(self, timeout=None):
+        """
+        Wait at most timeout seconds (None for no limit, 0 to poll) for
+        sockets in use to be readable and return the list of them.
         """
-        available_socket = None
-        if self._sockets:
-            available_socket = self._sockets.pop(0)
-            self._used_sockets.add(available_socket)
-        return available_socket
+        if self._selector is None:
+            return []
+        return [key.fileobj for key, _ in self._selector.select(timeout)]
@@ -0,0 +1,161 @@
+import collections
+import threading
+import time
+
+
+class TokenBucket(object):
+    """
+    Allow on average rate events per second with bursts of at most burst
+    events.
+    """
+
+    def __init__(self, rate, burst, now):
+        """
+        now: current time in seconds (the bucket starts full).
+        """
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._last = now
+
+    def consume(self, now):
+        """
+        Take a token and return True, or return False if there is none left.
+        """
+        self._tokens = min(
+            self._burst, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+
+class RateLimiter(object):
+    """
+    One TokenBucket per source (usually the ip of the sender).
+    """
+
+    def __init__(
+            self,
+            rate=5,
+            burst=10,
+            max_sources=4096,
+            clock=time.monotonic):
+        """
+        rate: messages per second allowed for each source.
+        burst: messages a silent source may send at once.
+        max_sources: number of sources remembered, the least recently seen
+        ones are forgotten first (which gives them a full bucket again).
+        clock: function returning the current time in seconds.
+        """
+        self._rate = rate
+        self._burst = burst
+        self._max_sources = max_sources
+        self._clock = clock
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._rejected = 0
+
+    @property
+    def rejected(self):
+        """
+        Number of messages refused so far.
+        """
+        return self._rejected
+
+    def allow(self, source):
+        """
+        Return True if a message from source may be answered.
+        """
+        with self._lock:
+            now = self._clock()
+            bucket = self._buckets.pop(source, None)
+            if bucket is None:
+                bucket = TokenBucket(self._rate, self._burst, now)
+            self._buckets[source] = bucket
+            while len(self._buckets) > self._max_sources:
+                self._buckets.popitem(last=False)
+            allowed = bucket.consume(now)
+            if not allowed:
+                self._rejected += 1
+            return allowed
+
+
+class ReplyCache(object):
+    """
+    Remember for ttl seconds the response sent to a message from an ip so
+    that duplicates (retries, even from another port) get the very same
+    response without computing it again.
+    """
+
+    def __init__(self, ttl=1.0, max_entries=4096, clock=time.monotonic):
+        """
+        ttl: duration in seconds a response is reused.
+        max_entries: number of responses remembered at most.
+        clock: function returning the current time in seconds.
+        """
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._clock = clock
+        # (message, ip) -> (response, expiry), kept in expiry order as they
+        # all last ttl
+        self._entries = collections.OrderedDict()
+        # ip -> messages of the entries for ip
+        self._messages = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+
+    @property
+    def hits(self):
+        """
+        Number of responses served from the cache so far.
+        """
+        return self._hits
+
+    def get(self, message, ip):
+        """
+        Return the response cached for message from ip or None.
+        """
+        with self._lock:
+            self._expire(self._clock())
+            entry = self._entries.get((bytes(message), ip))
+            if entry is None:
+                return None
+            self._hits += 1
+            response, _ = entry
+            return response
+
+    def put(self, message, ip, response):
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            key = (bytes(message), ip)
+            self._entries.pop(key, None)
+            self._entries[key] = (response, now + self._ttl)
+            self._messages.setdefault(ip, set()).add(key[0])
+            while len(self._entries) > self._max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, ip):
+        """
+        Forget the responses sent to ip.
+        """
+        with self._lock:
+            for message in self._messages.pop(ip, ()):
+                del self._entries[(message, ip)]
+
+    def _remove(self, key):
+        del self._entries[key]
+        message, ip = key
+        messages = self._messages[ip]
+        messages.discard(message)
+        if not messages:
+            del self._messages[ip]
+
+    def _expire(self, now):
+        while self._entries:
+            key, (_, expiry) = next(iter(self._entries.items()))
+            if expiry > now:
+                break
+            self._remove(key)
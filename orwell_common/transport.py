@@ -0,0 +1,28 @@
+import socket
+import time
+
+
+class SystemTransport(object):
+    """
+    Where the discovery classes get their sockets and their time from: the
+    operating system. See simulation.Fabric for an in-memory replacement.
+    """
+
+    def socket(self, family=socket.AF_INET, type=socket.SOCK_DGRAM):
+        return socket.socket(family, type)
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def time(self):
+        return time.time()
+
+    def wait(self, event, timeout):
+        """
+        Wait at most timeout seconds for event (a threading.Event) to be set
+        and return whether it is.
+        """
+        return event.wait(timeout)
+
+
+SYSTEM = SystemTransport()